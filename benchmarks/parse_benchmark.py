@@ -0,0 +1,36 @@
+"""
+Compares the parsing cost per page of the parsing strategies.
+Run it with `python -m benchmarks.parse_benchmark` from the root of the project.
+"""
+
+import timeit
+
+from benchmarks import synthetic_pages
+from dualis_connector import page_parser
+
+REPETITIONS = 50
+
+
+def _measure(markup: bytes, **parse_arguments) -> float:
+    seconds = timeit.timeit(lambda: page_parser.parse_page(markup, **parse_arguments), number=REPETITIONS)
+    return seconds / REPETITIONS * 1000
+
+def main():
+    token = '123456789012345'
+    semester_id = synthetic_pages.semester_ids(1)[0]
+    pages = [
+        ('semester list', synthetic_pages.course_results_page(token, 7), page_parser.SEMESTER_LIST),
+        ('course list', synthetic_pages.course_list_page(token, semester_id, 12), page_parser.COURSE_LIST),
+        ('result details', synthetic_pages.result_details_page('123'), page_parser.RESULT_DETAILS),
+    ]
+
+    print('Fast backend: %s'%(page_parser.FAST_BACKEND))
+    print('%-16s %10s %22s %22s'%('page', 'size', 'html.parser, full', 'fast backend, strained'))
+    for name, markup, strainer in pages:
+        full_ms = _measure(markup, backend='html.parser')
+        strained_ms = _measure(markup, parse_only=strainer)
+        print('%-16s %7.1f KB %14.2f ms/page %14.2f ms/page'%(name, len(markup) / 1024, full_ms, strained_ms))
+
+
+if __name__ == '__main__':
+    main()
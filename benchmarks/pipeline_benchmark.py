@@ -0,0 +1,123 @@
+"""
+Measures the whole Dualis pipeline (login, fetching, parsing, recording and diffing) end to end
+against a local stand-in of the Dualis System, for synthetic cohorts of different sizes.
+Run it with `python -m benchmarks.pipeline_benchmark` from the root of the project.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from benchmarks.standin_server import PASSWORD, StandInDualis
+from config_helper import ConfigHelper
+from dualis_connector import page_parser
+from dualis_connector.dualis_service import DualisService
+from dualis_connector.request_helper import RequestHelper, connection_pool
+from version_recorder import VersionRecorder
+
+
+class _Stopwatch:
+    """
+    Sums up the time spent in a function, over all threads.
+    """
+    def __init__(self, function):
+        self.function = function
+        self.seconds = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.seconds += time.perf_counter() - start
+
+    def reset(self):
+        with self._lock:
+            self.seconds = 0
+
+
+def _run_phase(name: str, stand_in: StandInDualis, action, parse_watch: _Stopwatch, diff_watch: _Stopwatch):
+    stand_in.reset_counters()
+    parse_watch.reset()
+    diff_watch.reset()
+
+    start = time.perf_counter()
+    detail = action()
+    total_seconds = time.perf_counter() - start
+
+    print('%-10s %9.0f ms %9s %10.1f KB %9.0f ms %9.0f ms   %s'%(
+        name, total_seconds * 1000, stand_in.request_count, stand_in.sent_bytes / 1024,
+        parse_watch.seconds * 1000, diff_watch.seconds * 1000, detail
+    ))
+
+def _benchmark_cohort(course_count: int, arguments, parse_watch: _Stopwatch, diff_watch: _Stopwatch):
+    stand_in = StandInDualis(
+        course_count, arguments.semesters, arguments.latency_ms, send_etags=not arguments.no_etags
+    ).start()
+    RequestHelper.host = stand_in.host
+    RequestHelper.is_secure = False
+
+    print('\n%s courses in %s semesters, %s ms latency:'%(course_count, arguments.semesters, arguments.latency_ms))
+    print('%-10s %12s %9s %13s %12s %12s'%('run', 'total', 'requests', 'received', 'parsing', 'diffing'))
+
+    working_dir = tempfile.mkdtemp(prefix='dualis-benchmark-')
+    previous_dir = os.getcwd()
+    os.chdir(working_dir)
+    try:
+        config_helper = ConfigHelper()
+        config_helper.set_property('max_parallel_requests', arguments.max_parallel_requests)
+        service = DualisService(config_helper)
+
+        def initial_run():
+            service.acquire_token('benchmark', PASSWORD)
+            service.fetch_and_save_unchecked_state()
+            return ''
+
+        def checking_run():
+            changes, _ = service.fetch_and_check_state()
+            if changes.diff_count > 0:
+                service.save_state()  # = a check without changes already saved its state itself
+            return '%s changes'%(changes.diff_count)
+
+        _run_phase('initial', stand_in, initial_run, parse_watch, diff_watch)
+        _run_phase('unchanged', stand_in, checking_run, parse_watch, diff_watch)
+        stand_in.grade_courses(arguments.changed_share)
+        _run_phase('changed', stand_in, checking_run, parse_watch, diff_watch)
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(working_dir, ignore_errors=True)
+        connection_pool.close_all()
+        stand_in.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the Dualis pipeline against a local stand-in.')
+    parser.add_argument('--cohorts', type=int, nargs='+', default=[10, 100, 1000],
+                        help='The numbers of courses to benchmark with.')
+    parser.add_argument('--semesters', type=int, default=6)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--max-parallel-requests', type=int, default=4)
+    parser.add_argument('--changed-share', type=float, default=0.1,
+                        help='The share of the courses which get new grades before the last run.')
+    parser.add_argument('--no-etags', action='store_true',
+                        help='Serve the result pages without ETags, so every one is transferred again.')
+    arguments = parser.parse_args()
+
+    # the parsing and diffing is measured by wrapping the functions, the modules look them up on
+    #  every call
+    parse_watch = _Stopwatch(page_parser.parse_page)
+    diff_watch = _Stopwatch(VersionRecorder.changes_of_new_version)
+    page_parser.parse_page = parse_watch
+    VersionRecorder.changes_of_new_version = lambda recorder: diff_watch(recorder)
+
+    print('Parsing and diffing are summed up over all threads, so they may exceed the total.')
+    for course_count in arguments.cohorts:
+        _benchmark_cohort(course_count, arguments, parse_watch, diff_watch)
+
+
+if __name__ == '__main__':
+    main()
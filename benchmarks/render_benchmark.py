@@ -0,0 +1,56 @@
+"""
+Compares the time it takes to render the diffs of a mail with the available highlighters.
+Run it with `python -m benchmarks.render_benchmark` from the root of the project.
+"""
+
+import timeit
+
+from dhbw_ma_schedule_connector.ical_diff import diff_icals
+from notification_services.mail import mail_formater
+
+REPETITIONS = 5
+
+
+def _schedule(event_count: int, location: str) -> str:
+    lines = ['BEGIN:VCALENDAR']
+    for i in range(event_count):
+        lines += [
+            'BEGIN:VEVENT',
+            'UID:%s@vorlesungsplan.dhbw-mannheim.de'%(i),
+            'DTSTART:201801%02dT080000'%(1 + i % 28),
+            'DTEND:201801%02dT100000'%(1 + i % 28),
+            'SUMMARY:Vorlesung %s'%(i),
+            'LOCATION:%s %s'%(location, i % 5),
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+def _measure(fragments: [str], highlighter: str) -> float:
+    seconds = timeit.timeit(
+        lambda: mail_formater.create_full_schedule_diff_mail(fragments, '123', highlighter), number=REPETITIONS
+    )
+    return seconds / REPETITIONS * 1000
+
+def main():
+    highlighters = ['builtin']
+    try:
+        import pygments  # noqa: F401 (only imported to check if it is available)
+        highlighters.append('pygments')
+    except ImportError:
+        pass
+
+    print('%-8s %10s %11s %20s %14s'%('events', 'diff', 'highlighter', 'render time', 'mail size'))
+    for event_count in [10, 100, 1000]:
+        fragments = diff_icals(_schedule(event_count, 'Raum A'), _schedule(event_count, 'Raum B'))
+        diff_kb = sum(len(fragment) for fragment in fragments) / 1024
+        for highlighter in highlighters:
+            render_ms = _measure(fragments, highlighter)
+            mail_kb = len(mail_formater.create_full_schedule_diff_mail(fragments, '123', highlighter)[0]) / 1024
+            print('%-8s %7.1f KB %11s %9.2f ms/KB diff %11.1f KB'%(
+                event_count, diff_kb, highlighter, render_ms / diff_kb, mail_kb
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+A local stand-in for the Dualis System, which serves synthetic (or recorded) pages, so the whole
+pipeline can be measured without credentials and without putting any load on Dualis.
+Run it on its own with `python -m benchmarks.standin_server --courses 100` from the root of the
+project.
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks import synthetic_pages
+
+TOKEN = '123456789012345'
+CNSC = 'B1C2D3E4F5A6B7C8D9E0F1A2B3C4D5E6'
+PASSWORD = 'secret'
+# the only password accepted by LOGINCHECK, every other one gets the login page with an error
+
+
+class StandInDualis:
+    """
+    Serves COURSERESULTS (the semester list and the course list of a semester), RESULTDETAILS and
+    LOGINCHECK like the Dualis System does it, over plain HTTP on localhost.
+    """
+    def __init__(self, course_count: int = 10, semester_count: int = 2, latency_ms: float = 0,
+                 error_mode: str = None, recorded_dir: str = None, send_etags: bool = True, port: int = 0):
+        """
+        @param latency_ms: How long every response is delayed.
+        @param error_mode: `execution_error` or `login_error` to answer every request with the
+         corresponding error page, or `sleeping` for the error page of the nightly maintenance.
+        @param recorded_dir: Directory with recorded pages, named `<PRGNAME>.html` or
+         `<PRGNAME>_<id>.html`, which are served instead of the synthetic ones if present.
+        @param send_etags: If the result pages are served with an ETag, so they can be requested
+         conditionally.
+        """
+        self.latency_ms = latency_ms
+        self.error_mode = error_mode
+        self.recorded_dir = recorded_dir
+        self.send_etags = send_etags
+
+        self.semester_ids = synthetic_pages.semester_ids(semester_count)
+        self.course_ids_by_semester = {}
+        for index, semester_id in enumerate(self.semester_ids):
+            count = course_count // semester_count + (1 if index < course_count % semester_count else 0)
+            self.course_ids_by_semester[semester_id] = synthetic_pages.course_ids(semester_id, count)
+        self.grades = {
+            course_id : ['noch nicht gesetzt', 'noch nicht gesetzt']
+            for course_ids in self.course_ids_by_semester.values() for course_id in course_ids
+        }
+
+        self.request_count = 0
+        self.sent_bytes = 0
+        self._lock = threading.Lock()
+
+        stand_in = self
+        class Handler(_Handler):
+            server_version = 'StandInDualis'
+            dualis = stand_in
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self) -> str:
+        return '127.0.0.1:%s'%(self._server.server_port)
+
+    def start(self) -> 'StandInDualis':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def grade_courses(self, share: float, seed: int = 0):
+        """
+        Sets grades for the given share of the courses, so they show up as changes.
+        """
+        randomizer = random.Random(seed)
+        course_ids = sorted(self.grades.keys())
+        for course_id in randomizer.sample(course_ids, int(len(course_ids) * share)):
+            self.grades[course_id] = [randomizer.choice(['1,0', '1,7', '2,3', '3,0']) for _ in range(2)]
+
+    def reset_counters(self):
+        with self._lock:
+            self.request_count = 0
+            self.sent_bytes = 0
+
+    def respond(self, method: str, path: str, body: bytes) -> (int, {str : str}, bytes):
+        arguments = parse_qs(urlsplit(path).query)
+        if method == 'POST':
+            arguments.update(parse_qs(body.decode('latin-1')))
+        program = arguments.get('PRGNAME', [''])[0]
+        program_arguments = arguments.get('ARGUMENTS', [''])[0].split(',')
+
+        if self.error_mode == 'execution_error':
+            return 200, {}, synthetic_pages.execution_error_page('Program not found')
+        elif self.error_mode == 'sleeping':
+            return 200, {}, synthetic_pages.execution_error_page('Aborting context')
+        elif self.error_mode == 'login_error':
+            return 200, {}, synthetic_pages.login_error_page()
+
+        if program == 'LOGINCHECK':
+            if arguments.get('pass', [''])[0] != PASSWORD:
+                return 200, {}, synthetic_pages.login_error_page()
+            return 200, {
+                'REFRESH': '0; URL=/scripts/mgrqispi.dll?APPNAME=CampusNet&PRGNAME=STARTPAGE_DISPATCH'
+                           '&ARGUMENTS=-N%s,-N000019,-N000000000000000'%(TOKEN),
+                'Set-cookie': 'cnsc=%s'%(CNSC),
+            }, b'<html><head><title>Login</title></head><body></body></html>'
+
+        if program_arguments[0] != '-N' + TOKEN:
+            return 200, {}, synthetic_pages.login_error_page()
+
+        object_id = program_arguments[2][len('-N'):] if len(program_arguments) > 2 else ''
+        recorded = self._recorded_page(program, object_id)
+        if recorded is not None:
+            return 200, {}, recorded
+
+        if program == 'COURSERESULTS' and object_id == '':
+            return 200, {}, synthetic_pages.course_results_page(TOKEN, len(self.semester_ids))
+        elif program == 'COURSERESULTS':
+            course_count = len(self.course_ids_by_semester.get(object_id, []))
+            return 200, {}, synthetic_pages.course_list_page(TOKEN, object_id, course_count)
+        elif program == 'RESULTDETAILS' and object_id in self.grades:
+            return 200, {}, synthetic_pages.result_details_page(object_id, self.grades[object_id])
+        else:
+            return 200, {}, synthetic_pages.execution_error_page('Program not found')
+
+    def _recorded_page(self, program: str, object_id: str) -> bytes:
+        if self.recorded_dir is None:
+            return None
+
+        for file_name in ['%s_%s.html'%(program, object_id), '%s.html'%(program)]:
+            path = os.path.join(self.recorded_dir, file_name)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    return f.read()
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # = keep-alive, like the real Dualis System
+    dualis = None
+
+    def do_GET(self):
+        self._handle('GET', b'')
+
+    def do_POST(self):
+        self._handle('POST', self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def _handle(self, method: str, body: bytes):
+        if self.dualis.latency_ms > 0:
+            time.sleep(self.dualis.latency_ms / 1000)
+
+        status, headers, content = self.dualis.respond(method, self.path, body)
+        if self.dualis.send_etags and method == 'GET' and 'PRGNAME=RESULTDETAILS' in self.path:
+            headers['ETag'] = '"%s"'%(hashlib.sha1(content).hexdigest()[:16])
+            if self.headers.get('If-None-Match') == headers['ETag']:
+                status, content = 304, b''
+        with self.dualis._lock:
+            self.dualis.request_count += 1
+            self.dualis.sent_bytes += len(content)
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if status != 304:
+            self.send_header('Content-Length', str(len(content)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass  # the benchmarks would be drowned in log lines otherwise
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves a local stand-in for the Dualis System.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--courses', type=int, default=10)
+    parser.add_argument('--semesters', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--error-mode', choices=['execution_error', 'login_error', 'sleeping'])
+    parser.add_argument('--recorded-dir')
+    parser.add_argument('--no-etags', action='store_true')
+    arguments = parser.parse_args()
+
+    stand_in = StandInDualis(
+        arguments.courses, arguments.semesters, arguments.latency_ms, arguments.error_mode,
+        arguments.recorded_dir, not arguments.no_etags, arguments.port
+    )
+    print('Serving a stand-in Dualis on http://%s (login with any user and the password `%s`)'%(
+        stand_in.host, PASSWORD
+    ))
+    stand_in.start()
+    try:
+        stand_in._thread.join()
+    except KeyboardInterrupt:
+        stand_in.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Generates synthetic pages which mimic the structure (and roughly the size) of the pages served by
+the Dualis System, as described in dualis_documentation.md.
+"""
+
+import random
+
+_page_frame = '''<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" lang="de">
+<head>
+    <title>%(title)s</title>
+    <meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+    <link rel="stylesheet" type="text/css" href="/css/styles.css" />
+    <script type="text/javascript">
+        var dl_popUp = function() { return false; };
+    </script>
+</head>
+<body>
+<div id="pageTop"><div id="pageTopNavi"><ul class="nav">%(navigation)s</ul></div></div>
+<div id="pageContainer">
+    <div id="pageLeft"><ul class="nav depth_2">%(side_navigation)s</ul></div>
+    <div id="pageContent">
+%(content)s
+    </div>
+</div>
+<div id="pageFoot"><p>Datenlotsen Informationssysteme GmbH</p></div>
+</body>
+</html>
+'''
+
+_exam_row = '''
+        <tr>
+            <td class="tbdata">%(semester)s</td>
+            <td class="tbdata">%(exam)s</td>
+            <td class="tbdata">%(date)s</td>
+            <td class="tbdata_numeric" style="vertical-align: top;">%(grade)s</td>
+            <td class="tbdata"></td>
+        </tr>'''
+
+
+def _wrap(title: str, content: str) -> bytes:
+    navigation = ''.join(
+        '<li class="tree depth_1"><a href="/scripts/mgrqispi.dll?APPNAME=CampusNet&amp;PRGNAME=EXTERNALPAGES'
+        '&amp;ARGUMENTS=-N000000000000001,-N%06d,-Amenu">Men&uuml;punkt %s</a></li>' % (i, i)
+        for i in range(60)
+    )
+    side_navigation = ''.join(
+        '<li class="intern depth_2"><a href="/scripts/mgrqispi.dll?APPNAME=CampusNet&amp;PRGNAME=MLSSTART'
+        '&amp;ARGUMENTS=-N000000000000001,-N%06d,">Unterpunkt %s</a></li>' % (i, i)
+        for i in range(40)
+    )
+    return (_page_frame % {
+        'title': title, 'navigation': navigation, 'side_navigation': side_navigation, 'content': content
+    }).encode('utf-8')
+
+def semester_ids(semester_count: int) -> [str]:
+    return ['%015d' % (1000000 + i) for i in range(semester_count)]
+
+def course_ids(semester_id: str, course_count: int) -> [str]:
+    return ['%s%03d' % (semester_id[3:], i) for i in range(course_count)]
+
+def course_results_page(token: str, semester_count: int) -> bytes:
+    options = ''.join(
+        '<option value="%s" %s>Semester %s</option>' % (semester_id, 'selected="selected"' if i == 0 else '', i + 1)
+        for i, semester_id in enumerate(semester_ids(semester_count))
+    )
+    content = '''
+        <h1>Pr&uuml;fungsergebnisse</h1>
+        <form><select id="semester" name="semester">%s</select></form>''' % (options)
+    return _wrap('Prüfungsergebnisse', content)
+
+def course_list_page(token: str, semester_id: str, course_count: int) -> bytes:
+    rows = ''.join(
+        '''
+            <tr>
+                <td class="tbdata">T3_%(i)04d</td>
+                <td class="tbdata">Modul %(i)s</td>
+                <td class="tbdata_numeric" style="text-align:center;">2,0</td>
+                <td class="tbdata_numeric">5,0</td>
+                <td class="tbdata">bestanden</td>
+                <td class="tbdata"><a id="Popup_details%(i)04d" href="/scripts/mgrqispi.dll?APPNAME=CampusNet&amp;PRGNAME=RESULTDETAILS&amp;ARGUMENTS=-N%(token)s,-N000307,-N%(course_id)s,-N000000015024000">Pr&uuml;fungen</a></td>
+            </tr>''' % {'i': i, 'token': token, 'course_id': course_id}
+        for i, course_id in enumerate(course_ids(semester_id, course_count))
+    )
+    content = '''
+        <h1>Pr&uuml;fungsergebnisse</h1>
+        <table class="nb list"><thead><tr><th>Nr.</th><th>Name</th><th>Note</th><th>Credits</th><th>Status</th><th></th></tr></thead>
+        <tbody>%s
+            <tr><td class="tbdata_numeric" colspan="2">Semester-GPA</td><td class="tbdata_numeric">2,0</td><td colspan="3"></td></tr>
+        </tbody></table>''' % (rows)
+    return _wrap('Prüfungsergebnisse', content)
+
+def result_details_page(course_id: str, grades: [str] = None, seed: int = None) -> bytes:
+    """
+    @param grades: The grades of the exams of the course, 'noch nicht gesetzt' if not yet graded.
+    """
+    randomizer = random.Random(seed if seed is not None else course_id)
+    if grades is None:
+        grades = [randomizer.choice(['1,0', '1,7', '2,3', '3,0', 'noch nicht gesetzt']) for _ in range(2)]
+
+    exam_rows = ''.join(
+        _exam_row % {
+            'semester': 'WiSe 2017/18', 'exam': 'Klausur %s (50%%)' % (i + 1),
+            'date': '%02d.0%s.2018' % (10 + i, 1 + i), 'grade': grade
+        }
+        for i, grade in enumerate(grades)
+    )
+    lectures = ''.join(
+        '<tr><td class="tbdata">T3_%s_%s</td><td class="tbdata">Vorlesung %s</td><td class="tbdata">Pflicht</td></tr>'
+        % (course_id, i, i) for i in range(4)
+    )
+    content = '''
+        <h1>
+            T3_%(course_id)s Modul %(course_id)s
+        </h1>
+        <table class="tb">
+            <tr><td class="level01" colspan="5">Modulabschlussleistungen</td></tr>
+            <tr><td class="level02" colspan="5">Versuch 1</td></tr>
+            %(exam_rows)s
+            <tr><td class="level00" colspan="3">Gesamt</td><td class="level00">%(total)s</td><td class="level00"></td></tr>
+        </table>
+        <table class="tb"><tr><td class="level01" colspan="3">Pflichtveranstaltungen</td></tr>%(lectures)s</table>''' % {
+        'course_id': course_id, 'exam_rows': exam_rows, 'lectures': lectures, 'total': grades[-1]
+    }
+    return _wrap('Prüfungsergebnisse', content)
+
+def execution_error_page(error: str = 'Aborting context') -> bytes:
+    return ('''<html><head><title>Execution Error</title></head><body>
+        <h1>Execution Error</h1>
+        <h3>Error</h3>
+        <h3>Details<div>%s</div></h3>
+    </body></html>''' % (error)).encode('utf-8')
+
+def login_error_page() -> bytes:
+    content = '''
+        <form id="cn_loginForm" method="post" action="/scripts/mgrqispi.dll"><input name="usrname" /><input name="pass" type="password" /></form>
+        <h1>Zugang verweigert</h1>Bitte melden Sie sich erneut an.&nbsp;<br />'''
+    return _wrap('Login', content)
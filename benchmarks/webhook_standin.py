@@ -0,0 +1,124 @@
+"""
+A local stand-in for a webhook receiver, which records every request posted to it.
+Run `python -m benchmarks.webhook_standin` from the root of the project to check the
+WebhookService against it: the JSON bodies (with the account of every event), the authentication
+taken from the URL, and that all deliveries share one pooled connection.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config_helper import ConfigHelper
+from dualis_connector.request_helper import connection_pool
+from notification_services.webhook.webhook_service import WebhookService
+
+
+class StandInWebhook:
+    def __init__(self, status: int = 204, port: int = 0):
+        """
+        @param status: The status every request is answered with.
+        """
+        self.status = status
+        self.requests = []  # [{'client': (host, port), 'path': .., 'headers': {..}, 'body': ..}]
+        self._lock = threading.Lock()
+
+        stand_in = self
+        class Handler(_Handler):
+            webhook = stand_in
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def address(self) -> str:
+        return '127.0.0.1:%s'%(self._server.server_port)
+
+    def start(self) -> 'StandInWebhook':
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # = keep-alive, so the reuse of the connection can be observed
+    webhook = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.webhook._lock:
+            self.webhook.requests.append({
+                'client': self.client_address, 'path': self.path, 'headers': dict(self.headers),
+                'body': body.decode('utf-8'),
+            })
+
+        self.send_response(self.webhook.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    stand_in = StandInWebhook().start()
+
+    working_dir = tempfile.mkdtemp(prefix='dualis-webhook-')
+    previous_dir = os.getcwd()
+    os.chdir(working_dir)  # the config and the outbox are created in the working directory
+    try:
+        config_helper = ConfigHelper()
+        config_helper.set_property('webhook', {
+            'url': 'http://bot:s3cret@%s/hook?channel=dualis'%(stand_in.address), 'redact_grades': True
+        })
+        service = WebhookService(config_helper)
+        config_helper.add_account('second')
+        account_service = WebhookService(config_helper.get_account_config('second'))
+        #                 ^ shares the webhook of the main account
+
+        service.notify_about_error('Note 1,3 konnte nicht gelesen werden')
+        service.notify_about_changes_in_schedule(['[...]\n\nBEGIN:VEVENT\nEND:VEVENT', '\n[...]'], 'abc')
+        account_service.notify_about_error('Fehler des zweiten Accounts')
+        first_delivered = service.deliver_pending()
+        service.notify_about_error('Noch ein Fehler')
+        second_delivered = service.deliver_pending()
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(working_dir, ignore_errors=True)
+        connection_pool.close_all()
+        stand_in.stop()
+
+    requests = stand_in.requests
+    bodies = [json.loads(request['body']) for request in requests]
+    checks = [
+        ('both deliveries succeeded', first_delivered and second_delivered),
+        ('one request per delivery', len(requests) == 2),
+        ('the path and query are kept', all(request['path'] == '/hook?channel=dualis' for request in requests)),
+        ('the credentials of the URL are sent as Basic Authentication', all(
+            request['headers'].get('Authorization') == 'Basic Ym90OnMzY3JldA==' for request in requests
+        )),
+        ('all pending events are posted together', [
+            [event['type'] for event in body] for body in bodies
+        ] == [['error', 'schedule', 'error'], ['error']]),
+        ('the events carry their account', [
+            [event['account'] for event in body] for body in bodies
+        ] == [[None, None, 'second'], [None]]),
+        ('the grades are redacted', '1,3' not in requests[0]['body']),
+        ('the connection is reused', len(set(request['client'] for request in requests)) == 1),
+    ]
+
+    for description, is_passed in checks:
+        print('%-4s %s'%('ok' if is_passed else 'FAIL', description))
+    if not all(is_passed for _, is_passed in checks):
+        sys.exit(-1)
+
+
+if __name__ == '__main__':
+    main()
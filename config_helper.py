@@ -1,5 +1,7 @@
 import json
 import os
+import re
+import threading
 
 
 class ConfigHelper:
@@ -8,6 +10,7 @@ class ConfigHelper:
     """
     def __init__(self):
         self._whole_config = {}
+        self._save_lock = threading.Lock()
 
     def is_present(self) -> bool:
         return os.path.isfile('config.json')
@@ -20,6 +23,15 @@ class ConfigHelper:
         except IOError:
             raise ValueError('No config found!')
 
+    def _change(self, change):
+        """
+        Applies the given change to the config and saves it, both under the lock, as multiple
+         accounts may be updated at the same time (i.e. when they log in again).
+        """
+        with self._save_lock:
+            change()
+            self._save()
+
     def _save(self):
         with open('config.json', 'w+') as f:
             config_formatted = json.dumps(self._whole_config, indent=4)
@@ -32,10 +44,99 @@ class ConfigHelper:
             raise ValueError('The %s-Property is not yet configured!'%(key))
 
     def set_property(self, key: str, value: any):
-        self._whole_config.update({key: value})
-        self._save()
+        self._change(lambda: self._whole_config.update({key: value}))
+
+    def remove_property(self, key):
+        self._change(lambda: self._whole_config.pop(key, None))
+        #                                                ^ behaviour if the key is not present
+
+    def get_account_name(self) -> str:
+        """
+        @return: The name of the account this configuration belongs to, None for the main account.
+        """
+        return None
+
+    def get_account_names(self) -> [str]:
+        """
+        @return: The names of all accounts which are configured to be watched in addition to the
+         main one.
+        """
+        return [account['name'] for account in self._whole_config.get('accounts', [])]
+
+    def get_account_config(self, name: str) -> 'AccountConfigHelper':
+        return AccountConfigHelper(self, name)
+
+    def add_account(self, name: str) -> 'AccountConfigHelper':
+        if not re.fullmatch(r'[a-zA-Z0-9_-][a-zA-Z0-9_.-]*', name):
+            raise ValueError('The account name may only contain letters, digits, `_`, `-` and `.`!')
+        if name in self.get_account_names():
+            raise ValueError('There already is an account named %s!'%(name))
+
+        accounts = self._whole_config.get('accounts', [])
+        accounts.append({'name': name})
+        self.set_property('accounts', accounts)
+
+        return self.get_account_config(name)
+
+    def remove_account(self, name: str):
+        accounts = [account for account in self._whole_config.get('accounts', []) if account['name'] != name]
+        self.set_property('accounts', accounts)
+
+
+class AccountConfigHelper(ConfigHelper):
+    """
+    A view on the configuration of one of the additionally watched accounts.
+    Properties of the account take precedence over the global ones, for dictionaries the entries of
+    both are merged. All changes only affect the account.
+    """
+    account_only_properties = ['token', 'cnsc', 'credentials', 'credentials_rejected', 'schedule']
+    # never taken over from the main account
+
+    def __init__(self, parent: ConfigHelper, name: str):
+        super().__init__()
+        self.parent = parent
+        self.name = name
+
+    def is_present(self) -> bool:
+        return self.name in self.parent.get_account_names()
+
+    def get_account_name(self) -> str:
+        return self.name
+
+    def load(self):
+        self.parent.load()
+
+    def _change(self, change):
+        self.parent._change(change)
+
+    def _account_config(self) -> {str : any}:
+        for account in self.parent._whole_config.get('accounts', []):
+            if account['name'] == self.name:
+                return account
+
+        raise ValueError('There is no account named %s!'%(self.name))
+
+    def get_property(self, key: str) -> any:
+        account_config = self._account_config()
+        try:
+            global_value = None if key in self.account_only_properties else self.parent.get_property(key)
+        except ValueError:
+            global_value = None
+
+        if key not in account_config:
+            if global_value is None:
+                raise ValueError('The %s-Property is not yet configured for %s!'%(key, self.name))
+            return global_value
+
+        value = account_config[key]
+        if isinstance(value, dict) and isinstance(global_value, dict):
+            merged_value = dict(global_value)
+            merged_value.update(value)
+            return merged_value
+        return value
+
+    def set_property(self, key: str, value: any):
+        self._change(lambda: self._account_config().update({key: value}))
 
     def remove_property(self, key):
-        self._whole_config.pop(key, None)
-        #                           ^ behaviour if the key is not present
-        self._save()
+        self._change(lambda: self._account_config().pop(key, None))
@@ -0,0 +1,128 @@
+"""
+Compares iCal calendars event by event instead of line by line.
+The events are indexed by their UID, so the effort grows only linearly with the number of events.
+"""
+
+VOLATILE_PROPERTIES = {'DTSTAMP', 'CREATED', 'LAST-MODIFIED', 'SEQUENCE'}
+# these change with every export of the calendar, without the lecture itself changing
+
+KEY_PROPERTIES = ['UID', 'SUMMARY']
+# shown for every changed event, so it can be recognized
+
+
+def iter_events(ical: str):
+    """
+    Walks through the calendar line by line, without building up more than the current event.
+    @return: Generator of the events, each as a dictionary with {property name : value}, the value
+     still including the parameters of the property (e.g. `;TZID=Europe/Berlin:20180110T080000`).
+    """
+    event = None
+    for line in _unfold(ical):
+        if line == 'BEGIN:VEVENT':
+            event = {}
+        elif line == 'END:VEVENT':
+            if event is not None:
+                yield event
+            event = None
+        elif event is not None and line != '':
+            separator_index = min(index for index in (line.find(':'), line.find(';'), len(line)) if index >= 0)
+            name = line[:separator_index].upper()
+            if name not in VOLATILE_PROPERTIES:
+                event[name] = line[separator_index:]
+
+
+def index_events(ical: str) -> {str : {str : str}}:
+    """
+    @return: Dictionary with {key of the event : event}. The key is the UID, extended by the
+     RECURRENCE-ID for changed occurrences of recurring events.
+    """
+    events = {}
+    for event in iter_events(ical):
+        key = event.get('UID', '')
+        if 'RECURRENCE-ID' in event:
+            key += event['RECURRENCE-ID']
+        if key in events or key == '':
+            # = the calendar doesn't identify its events properly, so the content has to do it
+            key += '#' + '\n'.join('%s%s'%(name, value) for name, value in sorted(event.items()))
+        events[key] = event
+
+    return events
+
+
+def normalize_ical(ical: str) -> str:
+    """
+    @return: The events of the calendar without their volatile properties, ordered by their key and
+     each with its properties in alphabetical order. Equivalent calendars are normalized to the
+     same text.
+    """
+    events = index_events(ical)
+
+    lines = []
+    for key in sorted(events):
+        lines.append('BEGIN:VEVENT')
+        lines += ['%s%s'%(name, value) for name, value in sorted(events[key].items())]
+        lines.append('END:VEVENT')
+
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def diff_icals(old_ical: str, new_ical: str) -> [str]:
+    """
+    @return: One fragment for every added, removed or changed event (i.e. moved lectures), marked
+     like a word-diff and followed by a final '[...]' marker. Empty if the calendars are
+     equivalent.
+    """
+    old_events = index_events(old_ical)
+    new_events = index_events(new_ical)
+
+    fragments = []
+    for key in sorted(old_events.keys() - new_events.keys()):
+        fragments.append(_format_event(old_events[key], '[-', '-]'))
+    for key in sorted(new_events.keys() - old_events.keys()):
+        fragments.append(_format_event(new_events[key], '{+', '+}'))
+    for key in sorted(old_events.keys() & new_events.keys()):
+        old_event = old_events[key]
+        new_event = new_events[key]
+        if old_event == new_event:
+            continue
+
+        lines = [
+            '%s%s'%(name, new_event[name]) for name in KEY_PROPERTIES
+            if name in new_event and old_event.get(name) == new_event[name]
+        ]
+        for name in sorted(old_event.keys() | new_event.keys()):
+            if old_event.get(name) == new_event.get(name):
+                continue
+            changed_line = ''
+            if name in old_event:
+                changed_line += '[-%s%s-]'%(name, old_event[name])
+            if name in new_event:
+                changed_line += ' {+%s%s+}'%(name, new_event[name])
+            lines.append(changed_line.strip())
+        fragments.append('[...]\n\nBEGIN:VEVENT\n' + '\n'.join(lines) + '\nEND:VEVENT')
+
+    if len(fragments) == 0:
+        return []
+
+    fragments.append('\n[...]')
+    return fragments
+
+
+def _format_event(event: {str : str}, start_marker: str, end_marker: str) -> str:
+    lines = [start_marker + '%s%s'%(name, value) + end_marker for name, value in sorted(event.items())]
+    return '[...]\n\nBEGIN:VEVENT\n' + '\n'.join(lines) + '\nEND:VEVENT'
+
+
+def _unfold(ical: str):
+    # long lines are folded by the iCal format into multiple lines, every continuation starting with
+    #  a space or a tab
+    current_line = None
+    for line in ical.splitlines():
+        if line[:1] in (' ', '\t') and current_line is not None:
+            current_line += line[1:]
+            continue
+        if current_line is not None:
+            yield current_line
+        current_line = line
+    if current_line is not None:
+        yield current_line
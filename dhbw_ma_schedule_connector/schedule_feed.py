@@ -0,0 +1,223 @@
+import gzip
+import logging
+import os
+import re
+import threading
+
+import metrics
+from dhbw_ma_schedule_connector.ical_diff import diff_icals, normalize_ical
+from dualis_connector.request_helper import connection_pool, get_conditional_headers, get_validators
+from fingerprint_cache import FingerprintCache
+from version_recorder import VersionRecorder
+
+
+SCHEDULE_HOST = 'vorlesungsplan.dhbw-mannheim.de'
+SCHEDULE_FILE_ID = 'schedule.ical'
+FEEDS_DIR = '_schedules'
+# every watched schedule is recorded in a sub-directory of its own, named after its UID
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+@metrics.timed('schedule.fetch')
+def fetch_schedule(uid: str, validators: {str : str} = None) -> (str, {str : str}):
+    """
+    @param validators: The validators (`etag` and/or `last_modified`) of the previously fetched
+     version of the schedule, if known.
+    @return: Tuple with (the schedule, or None if the server confirmed that it wasn't modified ,
+     the validators of the current version)
+    """
+    validators = validators or {}
+    headers = {'Accept-Encoding': 'gzip'}
+    headers.update(get_conditional_headers(validators))
+
+    response, body = connection_pool.request(
+        SCHEDULE_HOST, 'GET',
+        '/ical.php?uid=%s'%(uid),
+        headers=headers
+    )
+
+    response_status = response.getcode()
+    if response_status == 304:
+        return None, validators
+    if response_status != 200:
+        raise RuntimeError('Server reported Status %s'%(response_status))
+
+    if response.getheader('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+
+    return body.decode('utf-8'), get_validators(response)
+
+
+def get_feed(uid: str, export_to_git: bool = None, legacy_dir: str = None) -> 'ScheduleFeed':
+    """
+    @return: The feed of the schedule with the given UID, which is shared by all its subscribers
+     in this process.
+    @param legacy_dir: The directory in which a former version recorded the schedule for a single
+     account. Its last state becomes the base of the feed, if the feed has none yet.
+    """
+    with _feeds_lock:
+        if uid not in _feeds:
+            _feeds[uid] = ScheduleFeed(uid, export_to_git, legacy_dir)
+        return _feeds[uid]
+
+
+class ScheduleFeed:
+    """
+    Fetches, records and compares the schedule with one UID.
+
+    The schedule is only fetched and compared once for all subscribers. The detected changes are
+    handed out to every subscriber, until one of them asks again, which starts a new check. The new
+    state is persisted as soon as every subscriber which got the changes saved it, so a failed
+    notification leads to the changes being detected again in the next check.
+    """
+    def __init__(self, uid: str, export_to_git: bool = None, legacy_dir: str = None):
+        self.uid = uid
+        recorder_dir = os.path.join(FEEDS_DIR, re.sub(r'[^a-zA-Z0-9_.-]', '_', uid))
+        is_new = not os.path.exists(recorder_dir)
+
+        self.recorder = VersionRecorder(recorder_dir, export_to_git, differ=diff_icals)
+        self.fingerprints = FingerprintCache(recorder_dir + '.fingerprints.json')
+        self.is_state_floating = False
+
+        self._lock = threading.Lock()
+        self._changes = None  # = the result of the current check, None if there is none
+        self._served_subscribers = set()
+        self._saved_subscribers = set()
+
+        if is_new and legacy_dir is not None:
+            self._import_legacy_state(legacy_dir)
+
+    def fetch_and_save_unchecked_state(self) -> None:
+        """
+        Fetches the current state and directly saves it, without comparison with a previous state.
+        """
+        with self._lock:
+            schedule, validators = fetch_schedule(self.uid)
+
+            if self.recorder.is_creating_new_version:
+                self.recorder.abort_new_version()
+                self.is_state_floating = False
+            self.recorder.start_new_version()
+            normalized_schedule = normalize_ical(schedule)
+            try:
+                self.recorder.save_file(SCHEDULE_FILE_ID, normalized_schedule)
+                self.recorder.persist_new_version()
+            except BaseException:
+                self.recorder.abort_new_version()
+                raise
+
+            self.fingerprints.stage(
+                SCHEDULE_FILE_ID, fingerprint=FingerprintCache.compute(normalized_schedule), validators=validators
+            )
+            self.fingerprints.commit()
+            self._changes = None
+
+    def fetch_and_check_state(self, subscriber: object) -> [str]:
+        """
+        @param subscriber: Who asks for the changes, to be passed to save_state as well.
+        @return: A list of differences to the last known state.
+        """
+        with self._lock:
+            if self._changes is None or subscriber in self._served_subscribers:
+                self._changes = self._fetch_and_check_state()
+                self._served_subscribers = set()
+                self._saved_subscribers = set()
+            else:
+                logging.debug('Reusing the current check of the Schedule %s.'%(self.uid))
+
+            self._served_subscribers.add(subscriber)
+            return self._changes
+
+    def save_state(self, subscriber: object) -> None:
+        """
+        Confirms that the given subscriber was notified about the changes. Once all subscribers
+         did so, the new state is persisted.
+        """
+        with self._lock:
+            self._saved_subscribers.add(subscriber)
+            if not self.is_state_floating or not self._served_subscribers <= self._saved_subscribers:
+                return
+
+            logging.debug('Saving new, current state of the Schedule %s as new version...'%(self.uid))
+            self.recorder.persist_new_version()
+            self.fingerprints.commit()
+            self.is_state_floating = False
+
+    def _fetch_and_check_state(self) -> [str]:
+        logging.debug('Fetching current Schedule %s...'%(self.uid))
+        validators = {}
+        if self.recorder.has_file(SCHEDULE_FILE_ID):
+            validators = self.fingerprints.get(SCHEDULE_FILE_ID).get('validators', {})
+        schedule, validators = fetch_schedule(self.uid, validators)
+        if schedule is None:
+            # = the server confirmed that the schedule didn't change since it was persisted
+            logging.debug('The schedule was not modified.')
+            return []
+
+        logging.debug('Saving new state...')
+        if self.recorder.is_creating_new_version:
+            # = the state of a previous check was never saved (i.e. because notifying about it
+            #    failed), it gets replaced by the current one
+            self.recorder.abort_new_version()
+            self.is_state_floating = False
+        self.recorder.start_new_version()
+        try:
+            return self._check_new_version(schedule, validators)
+        except BaseException:
+            # otherwise the recorder would be stuck in the creation of this version, and every
+            #  following check would fail
+            self.recorder.abort_new_version()
+            self.is_state_floating = False
+            raise
+
+    def _check_new_version(self, schedule: str, validators: {str : str}) -> [str]:
+        normalized_schedule = normalize_ical(schedule)
+        # = only the events themselves are stored and fingerprinted, so neither changes with every
+        #    export (i.e. by its DTSTAMP)
+        fingerprint = FingerprintCache.compute(normalized_schedule)
+        self.fingerprints.stage(SCHEDULE_FILE_ID, fingerprint=fingerprint, validators=validators)
+        if self.fingerprints.matches(SCHEDULE_FILE_ID, fingerprint) and self.recorder.keep_file(SCHEDULE_FILE_ID):
+            logging.debug('The schedule is unchanged.')
+        else:
+            self.recorder.save_file(SCHEDULE_FILE_ID, normalized_schedule)
+
+        logging.debug('Checking for changes...')
+        changes = self.recorder.changes_of_new_version()
+
+        self.is_state_floating = True
+
+        if SCHEDULE_FILE_ID in changes.added:
+            # = there is no previous state to compare with, so this one becomes the base
+            logging.info('No previous state of the Schedule %s known, saving the current one as base.'%(self.uid))
+            self.recorder.persist_new_version()
+            self.fingerprints.commit()
+            self.is_state_floating = False
+            return []
+        elif changes.diff_count > 0:
+            if SCHEDULE_FILE_ID in changes.modified:
+                return changes.modified[SCHEDULE_FILE_ID]
+            else:
+                raise ValueError('Unexpected state!')
+        else:
+            # = the persisted state already matches the current one (apart from its format, which
+            #    is taken over silently)
+            self.recorder.persist_new_version()
+            self.fingerprints.commit()
+            self.is_state_floating = False
+            return []
+
+    def _import_legacy_state(self, legacy_dir: str):
+        legacy_path = os.path.join(legacy_dir, '.snapshot', SCHEDULE_FILE_ID)
+        if not os.path.isfile(legacy_path):
+            legacy_path = os.path.join(legacy_dir, SCHEDULE_FILE_ID)
+            if not os.path.isfile(legacy_path):
+                return
+
+        with open(legacy_path, encoding='utf-8', errors='backslashreplace', newline='') as f:
+            legacy_schedule = f.read()
+
+        self.recorder.start_new_version()
+        self.recorder.save_file(SCHEDULE_FILE_ID, normalize_ical(legacy_schedule))
+        self.recorder.persist_new_version()
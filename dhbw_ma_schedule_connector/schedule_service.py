@@ -1,28 +1,51 @@
-import logging
-from http.client import HTTPSConnection
+from concurrent.futures import ThreadPoolExecutor
 
 from config_helper import ConfigHelper
-from version_recorder import VersionRecorder
+from dhbw_ma_schedule_connector.schedule_feed import ScheduleFeed, fetch_schedule, get_feed
+from dualis_connector.request_helper import get_max_parallel_requests
 
 
 class ScheduleService:
-    def __init__(self, config_helper: ConfigHelper):
+    """
+    Watches the configured schedules for one subscriber (i.e. one account). The schedules themselves
+    are fetched and recorded by feeds, which are shared with all other subscribers of the same UID.
+    """
+    def __init__(self, config_helper: ConfigHelper, recorder_dir: str = '_schedule'):
+        """
+        @param recorder_dir: The directory in which a former version recorded the single schedule of
+         this subscriber. It is only read to take over the last state.
+        """
         self.config_helper = config_helper
+        self.legacy_dir = recorder_dir
         try:
-            self.uid = self.config_helper.get_property('schedule')['uid']
-            self.is_activated = True
+            self.uids = self._read_uids(self.config_helper.get_property('schedule'))
+            self.is_activated = len(self.uids) > 0
         except ValueError:
-            self.uid = None
+            self.uids = []
             self.is_activated = False
 
-        self.recorder = VersionRecorder('_schedule')
-        self.is_state_floating = False
+    @staticmethod
+    def _read_uids(schedule_config: {str : any}) -> [str]:
+        if 'uids' in schedule_config:
+            return list(schedule_config['uids'])
+        return [schedule_config['uid']]  # = configured by a former version, with a single schedule
+
+    def _get_feeds(self) -> [ScheduleFeed]:
+        try:
+            export_to_git = bool(self.config_helper.get_property('export_versions_to_git'))
+        except ValueError:
+            export_to_git = None
+
+        return [
+            get_feed(uid, export_to_git, self.legacy_dir if len(self.uids) == 1 else None)
+            for uid in self.uids
+        ]
 
     def interactively_configure(self) -> bool:
         """
-        Walks the user through configuring the watcher for a DHBW Mannheim Schedule, if they want to 
+        Walks the user through configuring the watcher for DHBW Mannheim Schedules, if they want to
         activate it.
-        @return: If the user selected to activate the schedule watcher. 
+        @return: If the user selected to activate the schedule watcher.
         """
         do_config_input = input(
             'Do you want to activate a Watcher for a DHBW Mannheim Course-Schedule [y/n]?   '
@@ -32,19 +55,25 @@ class ScheduleService:
 
         if do_config_input == 'n':
             self.is_activated = False
+            self.uids = []
             self.config_helper.remove_property('schedule')
         else:
             print(
                   'Go to `https://vorlesungsplan.dhbw-mannheim.de/ical.php` and select your course.'
                 + '\nYou will be presented with a link ending in `?uid=`, what follows after that is the UID.'
+                + '\nTo watch multiple schedules, separate their UIDs by commas.'
             )
             is_config_valid = False
             while not is_config_valid:
-                uid = input('Paste the displayed UID here:   ')
+                uids_raw = input('Paste the displayed UID(s) here:   ')
+                uids = [uid.strip() for uid in uids_raw.split(',') if uid.strip() != '']
 
-                print('Testing given UID...')
+                print('Testing given UID(s)...')
                 try:
-                    result = self._fetch_state(uid)
+                    if len(uids) == 0:
+                        raise ValueError('No UID given')
+                    for uid in uids:
+                        fetch_schedule(uid)
                 except BaseException as e:
                     print(
                         'Error at trying to access the schedule with the given UID (%s)! Please try again.'%(
@@ -52,29 +81,18 @@ class ScheduleService:
                         )
                     )
                 else:
-                    self.uid = uid
+                    self.uids = uids
                     is_config_valid = True
 
-            self.config_helper.set_property('schedule', {'uid': self.uid})
+            if len(self.uids) == 1:
+                self.config_helper.set_property('schedule', {'uid': self.uids[0]})
+            else:
+                self.config_helper.set_property('schedule', {'uids': self.uids})
 
             self.is_activated = True
 
         return self.is_activated
 
-    def _fetch_state(self, uid) -> str:
-        connection = HTTPSConnection('vorlesungsplan.dhbw-mannheim.de')
-        connection.request(
-            'GET',
-            '/ical.php?uid=%s'%(uid)
-        )
-        response = connection.getresponse()
-
-        response_status = response.getcode()
-        if response_status != 200:
-            raise RuntimeError('Server reported Status %s'%(response_status))
-
-        return response.read().decode('utf-8')
-
     def fetch_and_save_unchecked_state(self) -> None:
         """
         Fetches the current state and directly saves it, without comparison with a previous state.
@@ -82,47 +100,30 @@ class ScheduleService:
         if not self.is_activated:
             raise ValueError('Not activated and configured!')
 
-        schedule = self._fetch_state(self.uid)
-
-        self.recorder.start_new_version()
-        self.recorder.save_file('schedule.ical', schedule)
-        self.recorder.persist_new_version()
+        for feed in self._get_feeds():
+            feed.fetch_and_save_unchecked_state()
 
-    def fetch_and_check_state(self) -> [str]:
+    def fetch_and_check_state(self) -> {str : [str]}:
         """
-        Fetches the current state of the schedule and compares it to the previous.
-        @return: A list of differences to the last known state.
+        Fetches the current state of the schedules and compares them to the previous. Multiple
+         schedules are fetched in parallel.
+        @return: Dictionary with {UID : list of differences to the last known state}
         """
         if not self.is_activated:
             raise ValueError('Not activated and configured!')
 
-        logging.debug('Fetching current Schedule...')
-        schedule = self._fetch_state(self.uid)
-
-        logging.debug('Saving new state...')
-        self.recorder.start_new_version()
-        self.recorder.save_file('schedule.ical', schedule)
-
-        logging.debug('Checking for changes...')
-        changes = self.recorder.changes_of_new_version()
-
-        self.is_state_floating = True
-
-        if changes.diff_count > 0:
-            if 'schedule.ical' in changes.modified:
-                return changes.modified['schedule.ical']
-            else:
-                raise ValueError('Unexpected state!')
+        feeds = self._get_feeds()
+        check = lambda feed: feed.fetch_and_check_state(self)
+        if len(feeds) == 1:
+            changes = [check(feeds[0])]
         else:
-            return []
+            with ThreadPoolExecutor(max_workers=get_max_parallel_requests(self.config_helper)) as executor:
+                changes = list(executor.map(check, feeds))
 
-    def save_state(self) -> None:
+        return { feed.uid : feed_changes for feed, feed_changes in zip(feeds, changes) }
+
+    def save_state(self, uid: str) -> None:
         """
-        Persists a, until now, unsaved state. 
+        Confirms that the changes of the schedule with the given UID were handled.
         """
-        if not self.is_state_floating:
-            raise ValueError('There is no floating state to save!')
-
-        logging.debug('Saving new, current state as new version...')
-        self.recorder.persist_new_version()
-        self.is_state_floating = False
+        get_feed(uid).save_state(self)
@@ -0,0 +1,133 @@
+"""
+Keeps the credentials of a Dualis-Account encrypted in the config, so a new token can be obtained
+without any user interaction once the saved one gets rejected.
+Needs the optional package `cryptography`. The key is read from the environment variable
+`DUALIS_WATCHER_KEY` or, if that is not set, from the file `credentials.key`, which is created with
+access for the owner only. Without the key the stored credentials are worthless, so keep it apart
+from backups of the config.
+"""
+
+import importlib.util
+import json
+import logging
+import os
+
+from config_helper import ConfigHelper
+
+KEY_ENVIRONMENT_VARIABLE = 'DUALIS_WATCHER_KEY'
+KEY_FILE_NAME = 'credentials.key'
+
+
+def is_available() -> bool:
+    # cryptography is only imported once credentials are actually stored or loaded, as that is
+    #  expensive and not needed in most runs
+    return importlib.util.find_spec('cryptography') is not None
+
+
+class CredentialStore:
+    def __init__(self, config_helper: ConfigHelper, key_file_name: str = KEY_FILE_NAME):
+        self.config_helper = config_helper
+        self.key_file_name = key_file_name
+
+    def is_present(self) -> bool:
+        try:
+            self.config_helper.get_property('credentials')
+            return True
+        except ValueError:
+            return False
+
+    def save(self, username: str, password: str):
+        if not is_available():
+            raise CredentialStoreError('The credentials can only be stored if `cryptography` is installed!')
+
+        from cryptography.fernet import Fernet
+
+        plain = json.dumps({'username': username, 'password': password}).encode('utf-8')
+        encrypted = Fernet(self._get_key(create=True)).encrypt(plain)
+        self.config_helper.set_property('credentials', encrypted.decode('ascii'))
+        self.clear_rejection()
+
+    def load(self) -> (str, str):
+        """
+        @return: Tuple with (username , password), or None if no credentials are stored or they were
+         rejected by the Dualis System.
+        """
+        try:
+            encrypted = self.config_helper.get_property('credentials')
+        except ValueError:
+            return None
+
+        if self.is_rejected():
+            logging.warning(
+                'The stored credentials were rejected before, they are not used again until a new token '
+                + 'is obtained with `--new-token`.'
+            )
+            return None
+
+        if not is_available():
+            raise CredentialStoreError('The stored credentials can only be used if `cryptography` is installed!')
+
+        from cryptography.fernet import Fernet, InvalidToken
+
+        try:
+            plain = Fernet(self._get_key()).decrypt(encrypted.encode('ascii'))
+        except InvalidToken:
+            raise CredentialStoreError('The stored credentials can not be decrypted with the given key!')
+
+        credentials = json.loads(plain.decode('utf-8'))
+        return credentials['username'], credentials['password']
+
+    def remove(self):
+        self.config_helper.remove_property('credentials')
+        self.clear_rejection()
+
+    def is_rejected(self) -> bool:
+        try:
+            return bool(self.config_helper.get_property('credentials_rejected'))
+        except ValueError:
+            return False
+
+    def mark_rejected(self):
+        """
+        Remembers that the Dualis System rejected the stored credentials (i.e. because the password
+         was changed), so they aren't tried again with every check.
+        """
+        self.config_helper.set_property('credentials_rejected', True)
+
+    def clear_rejection(self):
+        if self.is_rejected():
+            self.config_helper.remove_property('credentials_rejected')
+
+    def describe_key_location(self) -> str:
+        """
+        @return: Where the key for the stored credentials is taken from, for telling the user.
+        """
+        if os.environ.get(KEY_ENVIRONMENT_VARIABLE):
+            return 'the environment variable `%s`'%(KEY_ENVIRONMENT_VARIABLE)
+        return '`%s`'%(self.key_file_name)
+
+    def _get_key(self, create: bool = False) -> bytes:
+        if os.environ.get(KEY_ENVIRONMENT_VARIABLE):
+            return os.environ[KEY_ENVIRONMENT_VARIABLE].encode('ascii')
+
+        try:
+            with open(self.key_file_name, 'rb') as f:
+                return f.read().strip()
+        except IOError:
+            if not create:
+                raise CredentialStoreError('The key for the stored credentials (%s) is missing!'%(self.key_file_name))
+
+        from cryptography.fernet import Fernet
+
+        key = Fernet.generate_key()
+        file_descriptor = os.open(self.key_file_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        #                                                                       ^ = readable for the
+        #                                                                          owner only
+        with os.fdopen(file_descriptor, 'wb') as f:
+            f.write(key)
+        return key
+
+
+class CredentialStoreError(Exception):
+    """An Exception which gets thrown if the stored credentials can't be used (i.e. the key is missing)"""
+    pass
@@ -1,20 +1,27 @@
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 
 from bs4 import BeautifulSoup
 
+import metrics
 from config_helper import ConfigHelper
-from dualis_connector import login_helper
-from dualis_connector.request_helper import RequestRejectedError, RequestHelper
-from dualis_connector.results_handler import ResultsHandler
+from dualis_connector import credential_store, login_helper
+from dualis_connector.credential_store import CredentialStore
+from dualis_connector.request_helper import RequestRejectedError, RequestHelper, get_max_parallel_requests
+from dualis_connector.results_handler import ResultsHandler, diff_results, extract_exam_records, serialize_result
+from fingerprint_cache import FingerprintCache
 from version_recorder import VersionRecorder, CollectionOfChanges
 
 
 class DualisService:
-    def __init__(self, config_helper: ConfigHelper):
+    def __init__(self, config_helper: ConfigHelper, recorder_dir: str = '_course-results'):
         self.config_helper = config_helper
-        self.recorder = VersionRecorder('_course-results')
+        self.recorder = VersionRecorder(recorder_dir, self.get_export_to_git(), differ=diff_results)
+        self.fingerprints = FingerprintCache(recorder_dir + '.fingerprints.json')
+        self.credentials = CredentialStore(config_helper)
+        self._course_ids_of_state = []
 
         self.is_state_floating = False
 
@@ -24,12 +31,31 @@ class DualisService:
         @return: The Token for Dualis.
         """
         
-        print('[The following Input is not saved, it is only used temporarily to generate a login token.]')
+        if credential_store.is_available():
+            print('[The following Input is only used to generate a login token, unless you choose to store it afterwards.]')
+        else:
+            print('[The following Input is not saved, it is only used temporarily to generate a login token.]')
 
         dualis_username = input('Username for Dualis:   ')
         dualis_password = getpass('Password for Dualis [no output]:   ')
 
-        return self.acquire_token(dualis_username, dualis_password)
+        token = self.acquire_token(dualis_username, dualis_password)
+
+        if credential_store.is_available():
+            do_store_input = input(
+                'Do you want to store the credentials encrypted, so a new token can be obtained '
+                + 'automatically once this one expires [y/n]?   '
+            )
+            while not (do_store_input == 'y' or do_store_input == 'n'):
+                do_store_input = input('Unrecognized input. Try again:   ')
+
+            if do_store_input == 'y':
+                self.credentials.save(dualis_username, dualis_password)
+                print('Credentials stored. The key to decrypt them is in %s.'%(self.credentials.describe_key_location()))
+            elif self.credentials.is_present():
+                self.credentials.remove()  # = they may belong to another user
+
+        return token
 
     def acquire_token(self, dualis_username, dualis_password) -> str:
         """
@@ -64,48 +90,111 @@ class DualisService:
 
         self.config_helper.set_property('token', token)
         self.config_helper.set_property('cnsc', cnsc)
+        self.credentials.clear_rejection()  # = they may be tried again once this token expires
         
         return token
 
-    def _fetch_state(self) -> ({ str : BeautifulSoup}, {str : str}):
+    def _fetch_state(self, use_validators: bool = False) \
+            -> ({ str : BeautifulSoup}, {str : str}, {str : {str : str}}):
         """
         Fetches the current Result-State for the configured Dualis-Account
-        @return: Tuple with (result data , course names)
+        @param use_validators: If the known validators of the result pages should be sent along, so
+         the Dualis System can skip unchanged pages. Their result data is None then.
+        @return: Tuple with (result data , course names , validators of the result pages)
         """
         token = self.get_token()
         cnsc = self.get_cnsc()
+        max_in_flight = get_max_parallel_requests(self.config_helper)
 
-        request_helper = RequestHelper(token, cnsc)
-        list_handler = ResultsHandler(request_helper)
+        def fetch_result(course_id: str):
+            validators = {}
+            if use_validators and self.recorder.has_file(course_id):
+                validators = self.fingerprints.get(course_id).get('validators', {})
+            return list_handler.fetch_result(course_id, validators)
 
         courses = []
         results = {}
         try:
-            semesters = list_handler.fetch_semesters()
-            for semester in semesters:
-                courses += list_handler.fetch_courses(semester)
+            list_handler, semesters = self._open_session(token, cnsc)
 
-            for course_id in courses:
-                results.update(list_handler.fetch_result(course_id))
+            if max_in_flight > 1:
+                with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                    # executor.map keeps the order of the inputs, so the result is identical to the
+                    #  sequential path
+                    for semester_courses in executor.map(list_handler.fetch_courses, semesters):
+                        courses += semester_courses
+
+                    for result in executor.map(fetch_result, courses):
+                        results.update(result)
+            else:
+                for semester in semesters:
+                    courses += list_handler.fetch_courses(semester)
+
+                for course_id in courses:
+                    results.update(fetch_result(course_id))
         except (RequestRejectedError, ValueError, RuntimeError) as error:
             raise RuntimeError('Error while communicating with the Dualis System! (%s)' % (error))
 
         result_data = { k : v[0] for k, v in results.items()}
-        course_names = { k : v[1] for k, v in results.items()}
-        return (result_data, course_names)
+        course_names = {
+            k : v[1] if v[1] is not None else self.fingerprints.get(k).get('name', k)
+            for k, v in results.items()
+        }
+        validators = { k : v[2] for k, v in results.items()}
+        return (result_data, course_names, validators)
+
+    def _open_session(self, token: str, cnsc: str) -> (ResultsHandler, [str]):
+        """
+        Fetches the list of semesters, which is the first page of every crawl and so doubles as a
+         cheap probe of the session. If the token gets rejected and the credentials are stored, a
+         new token is obtained silently and saved, before any other page is fetched.
+        Errors of the credential store (i.e. a missing key) are raised as a CredentialStoreError.
+        @return: Tuple with (the ResultsHandler of the valid session , the ids of the semesters)
+        """
+        # The RequestHelper takes its connections from the shared pool, so it can be used by all
+        #  workers at the same time.
+        list_handler = ResultsHandler(RequestHelper(token, cnsc))
+        try:
+            return list_handler, list_handler.fetch_semesters()
+        except RequestRejectedError:
+            credentials = self.credentials.load()
+            if credentials is None:
+                raise
+
+        logging.info('The token was rejected, obtaining a new one with the stored credentials...')
+        metrics.count('dualis.relogins')
+        try:
+            token, cnsc = login_helper.obtain_login_token(*credentials)
+        except RequestRejectedError:
+            self.credentials.mark_rejected()
+            logging.error(
+                'The stored credentials were rejected, they are not used again until a new token is '
+                + 'obtained with `--new-token`.'
+            )
+            raise
+        self.config_helper.set_property('token', token)
+        self.config_helper.set_property('cnsc', cnsc)
+
+        list_handler = ResultsHandler(RequestHelper(token, cnsc))
+        return list_handler, list_handler.fetch_semesters()
 
     def fetch_and_save_unchecked_state(self) -> None:
         """
         Fetches the current Result-State of the configured Dualis-Account and directly saves it,  
          without checking for changes. 
         """
-        results = self._fetch_state()[0]
+        results = self._fetch_state()
 
         self.recorder.start_new_version()
-        for course_id, result_soup in results.items():
-            self.recorder.save_file(course_id, result_soup.prettify())
+        for course_id, result_soup in results[0].items():
+            content = serialize_result(results[1][course_id], extract_exam_records(result_soup))
+            self.recorder.save_file(course_id, content)
+            self._stage_fingerprint(course_id, content, results[1], results[2])
         self.recorder.persist_new_version()
 
+        self.fingerprints.commit()
+        self.fingerprints.retain_only(results[0].keys())
+
     def fetch_and_check_state(self) -> (CollectionOfChanges, {str : str}):
         """
         Fetches the current Result-State of the configured Dualis-Account and comperes it with the 
@@ -113,17 +202,53 @@ class DualisService:
         @return: Tuple with (detected changes, course names)
         """
         logging.debug('Fetching current Dualis State...')
-        results = self._fetch_state()
+        results = self._fetch_state(use_validators=True)
 
         logging.debug('Saving new state...')
+        if self.recorder.is_creating_new_version:
+            # = the state of a previous check was never saved (i.e. because notifying about it
+            #    failed), it gets replaced by the current one
+            self.recorder.abort_new_version()
         self.recorder.start_new_version()
-        for course_id, result_soup in results[0].items():
-            self.recorder.save_file(course_id, result_soup.prettify())
+        try:
+            skipped_count = 0
+            for course_id, result_soup in results[0].items():
+                if result_soup is None:
+                    # = the Dualis System confirmed that the page didn't change since it was persisted
+                    self.recorder.keep_file(course_id)
+                    skipped_count += 1
+                    continue
+
+                content = serialize_result(results[1][course_id], extract_exam_records(result_soup))
+                fingerprint = self._stage_fingerprint(course_id, content, results[1], results[2])
+                if self.fingerprints.matches(course_id, fingerprint) and self.recorder.keep_file(course_id):
+                    skipped_count += 1
+                else:
+                    self.recorder.save_file(course_id, content)
+            logging.debug('%s of %s courses are unchanged and were skipped.'%(skipped_count, len(results[0])))
 
-        logging.debug('Checking for changes...')
-        changes = self.recorder.changes_of_new_version()
+            logging.debug('Checking for changes...')
+            changes = self.recorder.changes_of_new_version()
+
+            # The content of all unchanged courses is already persisted, so their fingerprints can be
+            #  committed right away. The others are committed together with the new version.
+            self.fingerprints.commit([
+                course_id for course_id in results[0]
+                if course_id not in changes.added and course_id not in changes.modified
+            ])
+            self._course_ids_of_state = list(results[0].keys())
+        except BaseException:
+            # otherwise the recorder would be stuck in the creation of this version, and every
+            #  following check of the daemon would fail
+            self.recorder.abort_new_version()
+            self.is_state_floating = False
+            raise
 
         self.is_state_floating = True
+        if changes.diff_count == 0:
+            # = there is nothing to notify about, but files which only changed in their format are
+            #    taken over right away
+            self.save_state()
 
         return (changes, results[1])
 
@@ -136,7 +261,18 @@ class DualisService:
 
         logging.debug('Saving new, current state as new version...')
         self.recorder.persist_new_version()
+        self.fingerprints.commit()
+        self.fingerprints.retain_only(self._course_ids_of_state)
         self.is_state_floating = False
+
+    def _stage_fingerprint(self, course_id: str, content: str, course_names: {str : str},
+                           validators: {str : {str : str}}) -> str:
+        fingerprint = FingerprintCache.compute(content)
+        self.fingerprints.stage(
+            course_id,
+            fingerprint=fingerprint, name=course_names[course_id], validators=validators[course_id]
+        )
+        return fingerprint
    
     def get_token(self) -> str:
         try:
@@ -149,3 +285,12 @@ class DualisService:
             return self.config_helper.get_property('cnsc')
         except ValueError:
             raise ValueError('Not yet configured!')
+
+    def get_export_to_git(self) -> bool:
+        """
+        @return: If the versions should also be exported into a git repository, None if not configured.
+        """
+        try:
+            return bool(self.config_helper.get_property('export_versions_to_git'))
+        except ValueError:
+            return None
@@ -0,0 +1,210 @@
+import json
+from datetime import datetime, time, timedelta
+
+from file_helper import write_atomically
+
+
+HISTORY_DAYS = 14
+# observations older than this are forgotten, so the window adapts if Dualis changes its habits
+MIN_NIGHTS = 2
+# on how many different days Dualis has to be found sleeping before a window is trusted
+WAKE_UP_MARGIN_MINUTES = 5
+# how long after the last known sleeping time of the window the first probe is sent
+
+MINUTES_PER_DAY = 24 * 60
+TIME_FORMAT = '%Y-%m-%dT%H:%M'
+
+
+class NightWindow:
+    """
+    Learns the nightly maintenance window of the Dualis System from the points in time at which it
+    was found sleeping, so requests inside of it can be avoided.
+
+    Sleeping-observations belong to the same phase unless Dualis was seen awake at a time of the day
+    in between. The window is the phase in which Dualis was found sleeping on the most different
+    days, so one-time outages during the day don't disturb it. Inside the window, a single probe is
+    sent per night, which keeps its observations from aging out.
+    """
+    def __init__(self, file_name: str = 'night_window.json'):
+        self.file_name = file_name
+
+        try:
+            with open(file_name, 'r') as f:
+                raw = json.loads(f.read())
+            self._sleeping_at = [datetime.strptime(at, TIME_FORMAT) for at in raw['sleeping_at']]
+            self._awake_at = { int(minute) : datetime.strptime(at, TIME_FORMAT) for minute, at in raw['awake_at'].items() }
+            #                  ^ only the last observation for each minute of the day is needed
+        except (IOError, ValueError, KeyError):
+            self._sleeping_at = []
+            self._awake_at = {}
+
+    def record_sleeping(self, at: datetime = None):
+        """
+        Remembers that Dualis was found sleeping at the given point in time (or now).
+        If that is inside of the known window (i.e. by the probe of the night), the whole window is
+         confirmed for this night, so its edges are observed again as well.
+        """
+        at = (at or datetime.now()).replace(second=0, microsecond=0)
+        window = self.get_window(at)
+        self._sleeping_at.append(at)
+        if window is not None and self._is_between(at.hour * 60 + at.minute, window[0], window[1]):
+            night_start = datetime.combine((at - timedelta(minutes=window[0])).date(), time()) \
+                + timedelta(minutes=window[0])
+            for edge in [night_start, night_start + timedelta(minutes=(window[1] - window[0]) % MINUTES_PER_DAY)]:
+                if edge not in self._sleeping_at:
+                    self._sleeping_at.append(edge)
+        self._forget_old_observations(at)
+        self._save()
+
+    def record_awake(self, at: datetime = None):
+        """
+        Remembers that Dualis was found awake at the given point in time (or now).
+        """
+        at = (at or datetime.now()).replace(second=0, microsecond=0)
+        self._awake_at[at.hour * 60 + at.minute] = at
+        self._forget_old_observations(at)
+        self._save()
+
+    def get_window(self, now: datetime = None) -> (int, int, int):
+        """
+        @return: Tuple with (start of the window , end of the window , number of observations in it),
+         start and end in minutes since midnight. None if there are not enough observations yet.
+        """
+        now = now or datetime.now()
+        observations = [at for at in self._sleeping_at if at > now - timedelta(days=HISTORY_DAYS)]
+        if len(observations) == 0:
+            return None
+
+        minutes = sorted(set(at.hour * 60 + at.minute for at in observations))
+        awake_minutes = [
+            minute for minute, at in self._awake_at.items() if at > now - timedelta(days=HISTORY_DAYS)
+        ]
+
+        # Two neighbouring observations are separated if Dualis was seen awake in between. As the day
+        #  wraps around at midnight, we start behind a separation (or at least behind the biggest
+        #  gap), so no phase gets cut in half.
+        neighbours = [
+            (minutes[i], minutes[(i + 1) % len(minutes)], (i + 1) % len(minutes))
+            for i in range(len(minutes))
+        ]
+        separations = [
+            (self._gap(start, end), next_index) for start, end, next_index in neighbours
+            if any(self._is_strictly_between(awake, start, end) for awake in awake_minutes)
+        ]
+        first_index = max(separations or [(self._gap(start, end), i) for start, end, i in neighbours])[1]
+        ordered_minutes = minutes[first_index:] + minutes[:first_index]
+
+        clusters = [[ordered_minutes[0]]]
+        for minute in ordered_minutes[1:]:
+            if any(self._is_strictly_between(awake, clusters[-1][-1], minute) for awake in awake_minutes):
+                clusters.append([])
+            clusters[-1].append(minute)
+
+        best_window = None
+        best_nights = set()
+        for cluster in clusters:
+            start, end = cluster[0], cluster[-1]
+            in_cluster = [at for at in observations if self._is_between(at.hour * 60 + at.minute, start, end)]
+            nights = set((at - timedelta(minutes=start)).date() for at in in_cluster)
+            #                    ^ so observations before and after midnight count as the same night
+            if len(nights) > len(best_nights):
+                best_window = (start, end, len(in_cluster))
+                best_nights = nights
+
+        if len(best_nights) < MIN_NIGHTS:
+            return None
+
+        return best_window
+
+    def is_inside(self, now: datetime = None) -> bool:
+        """
+        @return: If Dualis is expected to be sleeping at the given point in time (or now).
+        """
+        now = now or datetime.now()
+        window = self.get_window(now)
+        if window is None:
+            return False
+
+        return self._is_before(
+            now.hour * 60 + now.minute, window[0], (window[1] + WAKE_UP_MARGIN_MINUTES) % MINUTES_PER_DAY
+        )
+        #                                       ^ the predicted wake-up itself is outside of the window
+
+    def is_probe_due(self, now: datetime = None) -> bool:
+        """
+        @return: If Dualis wasn't found sleeping in the window of the night of the given point in time
+         (or now) yet. Then a request should be sent anyway, otherwise the observations of the window
+         would age out and it would be forgotten after some days.
+        """
+        now = now or datetime.now()
+        window = self.get_window(now)
+        if window is None:
+            return True
+
+        night = (now - timedelta(minutes=window[0])).date()
+        return not any(
+            (at - timedelta(minutes=window[0])).date() == night
+            and self._is_between(at.hour * 60 + at.minute, window[0], window[1])
+            for at in self._sleeping_at
+        )
+
+    def predicted_wake_up(self, now: datetime = None) -> datetime:
+        """
+        @return: The next point in time (after the given one or now) at which Dualis is expected to
+         be awake again. None if no window is known yet.
+        """
+        now = now or datetime.now()
+        window = self.get_window(now)
+        if window is None:
+            return None
+
+        wake_up_minute = (window[1] + WAKE_UP_MARGIN_MINUTES) % MINUTES_PER_DAY
+        wake_up = now.replace(hour=wake_up_minute // 60, minute=wake_up_minute % 60, second=0, microsecond=0)
+        if wake_up <= now:
+            wake_up += timedelta(days=1)
+
+        return wake_up
+
+    def describe(self) -> str:
+        window = self.get_window()
+        if window is None:
+            return 'No sleeping window learned yet (%s observations in the last %s days).'%(
+                len(self._sleeping_at), HISTORY_DAYS
+            )
+
+        return 'Dualis is sleeping from %02d:%02d to %02d:%02d (learned from %s observations), next wake-up at %s.'%(
+            window[0] // 60, window[0] % 60, window[1] // 60, window[1] % 60, window[2],
+            self.predicted_wake_up().strftime('%Y-%m-%d %H:%M')
+        )
+
+    @staticmethod
+    def _gap(start: int, end: int) -> int:
+        return (end - start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+
+    @staticmethod
+    def _is_strictly_between(minute: int, start: int, end: int) -> bool:
+        return 0 < (minute - start) % MINUTES_PER_DAY < NightWindow._gap(start, end)
+
+    @staticmethod
+    def _is_before(minute: int, start: int, end: int) -> bool:
+        # = like _is_between, but without the end
+        return (minute - start) % MINUTES_PER_DAY < (end - start) % MINUTES_PER_DAY
+
+    @staticmethod
+    def _is_between(minute: int, start: int, end: int) -> bool:
+        if start <= end:
+            return start <= minute <= end
+        else:
+            return minute >= start or minute <= end  # = the window spans midnight
+
+    def _forget_old_observations(self, now: datetime):
+        self._sleeping_at = [at for at in self._sleeping_at if at > now - timedelta(days=HISTORY_DAYS)]
+        self._awake_at = {
+            minute : at for minute, at in self._awake_at.items() if at > now - timedelta(days=HISTORY_DAYS)
+        }
+
+    def _save(self):
+        write_atomically(self.file_name, json.dumps({
+            'sleeping_at': [at.strftime(TIME_FORMAT) for at in self._sleeping_at],
+            'awake_at': { minute : at.strftime(TIME_FORMAT) for minute, at in self._awake_at.items() }
+        }))
@@ -0,0 +1,41 @@
+"""
+Encapsulates the parsing of the pages returned by the Dualis System.
+Uses lxml, if it is installed, as it is a lot faster than the parser of the standard library.
+"""
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml  # noqa: F401 (only imported to check if it is available)
+    FAST_BACKEND = 'lxml'
+except ImportError:
+    FAST_BACKEND = 'html.parser'
+
+EXACT_BACKEND = 'html.parser'
+# Pages which get compared as a whole have to be parsed by this one, as every parser produces a
+#  slightly different tree, which would show up as changes.
+
+
+# Strainers, which let the parser only build the parts of the pages which we actually look at:
+SEMESTER_LIST = SoupStrainer('select', id='semester')
+COURSE_LIST = SoupStrainer('table', class_='nb list')
+RESULT_DETAILS = SoupStrainer(['h1', 'table'])
+
+
+def parse_page(markup: bytes, parse_only: SoupStrainer = None, backend: str = None) -> BeautifulSoup:
+    """
+    @param parse_only: If given, only the matching elements of the page are parsed.
+    @param backend: The parser to use. By default the fastest available one when only parts of the
+     page are parsed, and the exact one otherwise.
+    """
+    if backend is None:
+        backend = FAST_BACKEND if parse_only is not None else EXACT_BACKEND
+
+    return BeautifulSoup(markup, backend, parse_only=parse_only)
+
+def may_be_error_page(markup: bytes) -> bool:
+    """
+    A quick check on the raw page, before it is parsed. If this is False, the page is certainly
+     neither an Execution Error page nor the login page with an error message on it.
+    """
+    return b'Execution Error' in markup or b'cn_loginForm' in markup
@@ -1,16 +1,244 @@
 import re
+import select
+import ssl
+import threading
+import time
 import urllib
-from http.client import HTTPSConnection, HTTPResponse
+from http.client import HTTPConnection, HTTPSConnection, HTTPResponse, CannotSendRequest
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+import metrics
+from config_helper import ConfigHelper
+from dualis_connector import page_parser
+
+
+DUALIS_HOST = 'dualis.dhbw.de'
+
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE']
+# may be repeated if the connection broke after they were sent, the server can't do them twice
+DEFAULT_MAX_PARALLEL_REQUESTS = 4
+# kept low on purpose, we don't want to hammer the servers
+
+
+class _ResumingHTTPSConnection(HTTPSConnection):
+    """
+    A HTTPSConnection which resumes the last TLS session negotiated with the same host, so a
+     reconnect doesn't need to pay for a full handshake.
+    """
+    def __init__(self, host: str, tls_sessions: {str : object}, **kwargs):
+        super().__init__(host, **kwargs)
+        self._tls_sessions = tls_sessions
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        # = the plain connection, which also goes through the tunnel, if a proxy is used
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self._server_hostname(),
+            session=self._tls_sessions.get(self._server_hostname())
+        )
+
+    def getresponse(self) -> HTTPResponse:
+        tls_socket = self.sock  # = the connection drops it if the response closes the connection
+        response = super().getresponse()
+        # With TLS 1.3 the server only sends the session ticket after the handshake, so the session
+        #  can't be taken before the first response was received.
+        if tls_socket is not None and tls_socket.session is not None:
+            self._tls_sessions[self._server_hostname()] = tls_socket.session
+        return response
+
+    def _server_hostname(self) -> str:
+        # = with a proxy, the connection itself goes to the proxy and the TLS session to the server
+        return self._tunnel_host or self.host
+
+
+class ConnectionPool:
+    """
+    Keeps the connections to the used hosts alive and hands them out for reuse, so consecutive
+     requests (from the login, the result- and the schedule-fetching) share the same TLS sessions.
+    It is safe to use from multiple threads at once.
+    """
+    def __init__(self, max_idle_per_host: int = 8, max_idle_seconds: float = 30.0):
+        self.max_idle_per_host = max_idle_per_host
+        self.max_idle_seconds = max_idle_seconds
+
+        self._idle_connections = {}  # {(host, is_secure) : [(connection, last used at)]}
+        self._tls_context = None  # = shared by all connections, a session can only be resumed within its context
+        self._tls_sessions = {}
+        self._host_limits = {}  # {host : semaphore}
+        self._lock = threading.Lock()
+
+    def limit_host(self, host: str, max_in_flight: int):
+        """
+        Caps the number of requests which are in flight to the given host at the same time, across
+         all threads of this process.
+        """
+        self._host_limits[host] = threading.BoundedSemaphore(max_in_flight)
+
+    def request(self, host: str, method: str, url: str, body: str = None, headers: {str : str} = {},
+                is_secure: bool = True) -> (HTTPResponse, bytes):
+        """
+        Sends a request over a pooled connection to the given host.
+        If a reused connection was closed by the server in the meantime, the request is
+         transparently repeated over a fresh connection, unless it could have reached the server
+         already and is not idempotent (like the POST of the login).
+        @return: Tuple with (the response, its already read body)
+        """
+        host_limit = self._host_limits.get(host)
+        if host_limit is not None:
+            with host_limit:
+                return self._request(host, method, url, body, headers, is_secure)
+        else:
+            return self._request(host, method, url, body, headers, is_secure)
+
+    def _request(self, host: str, method: str, url: str, body: str, headers: {str : str},
+                 is_secure: bool) -> (HTTPResponse, bytes):
+        connection, is_reused = self._acquire(host, is_secure)
+        try:
+            is_sent = False
+            try:
+                connection.request(method, url, body=body, headers=headers)
+                is_sent = True
+                response = connection.getresponse()
+            except (ConnectionResetError, BrokenPipeError, CannotSendRequest):
+                #  ^ covers http.client.RemoteDisconnected, which is a ConnectionResetError
+                connection.close()
+                if not is_reused or (is_sent and method not in IDEMPOTENT_METHODS):
+                    raise
+
+                connection = self._create_connection(host, is_secure)
+                connection.request(method, url, body=body, headers=headers)
+                response = connection.getresponse()
+
+            body = response.read()  # the connection can only be reused after the response is consumed
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection, host, is_secure)
+
+        return response, body
+
+    def close_all(self):
+        with self._lock:
+            idle_connections = self._idle_connections
+            self._idle_connections = {}
+
+        for entries in idle_connections.values():
+            for connection, _ in entries:
+                connection.close()
+
+    def _acquire(self, host: str, is_secure: bool) -> (HTTPConnection, bool):
+        now = time.monotonic()
+        stale_connections = []
+        connection = None
+
+        with self._lock:
+            entries = self._idle_connections.get((host, is_secure), [])
+            while entries and connection is None:
+                candidate, last_used_at = entries.pop()
+                if now - last_used_at < self.max_idle_seconds and not _is_dropped(candidate):
+                    connection = candidate
+                else:
+                    stale_connections.append(candidate)
+
+        for stale_connection in stale_connections:
+            stale_connection.close()
+
+        if connection is not None:
+            return connection, True
+        else:
+            return self._create_connection(host, is_secure), False
+
+    def _release(self, connection: HTTPConnection, host: str, is_secure: bool):
+        with self._lock:
+            entries = self._idle_connections.setdefault((host, is_secure), [])
+            if len(entries) < self.max_idle_per_host:
+                entries.append((connection, time.monotonic()))
+                return
+
+        connection.close()
+
+    def _create_connection(self, host: str, is_secure: bool) -> HTTPConnection:
+        if is_secure:
+            with self._lock:
+                if self._tls_context is None:
+                    self._tls_context = ssl.create_default_context()
+            return _ResumingHTTPSConnection(host, self._tls_sessions, context=self._tls_context)
+        else:
+            return HTTPConnection(host)
+
+
+def get_conditional_headers(validators: {str : str}) -> {str : str}:
+    """
+    @param validators: The validators (`etag` and/or `last_modified`) of a previously fetched
+     version of a ressource.
+    @return: The headers which let the server answer with 304 if the ressource wasn't modified.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def get_validators(response: HTTPResponse) -> {str : str}:
+    """
+    @return: The validators of the version of the ressource in the given response.
+    """
+    validators = {}
+    if response.getheader('ETag'):
+        validators['etag'] = response.getheader('ETag')
+    if response.getheader('Last-Modified'):
+        validators['last_modified'] = response.getheader('Last-Modified')
+    return validators
+
+
+def get_max_parallel_requests(config_helper: ConfigHelper) -> int:
+    """
+    @return: How many requests of one check (i.e. for the course results or the schedules) may be in
+     flight at the same time.
+    """
+    try:
+        return max(1, int(config_helper.get_property('max_parallel_requests')))
+    except ValueError:
+        return DEFAULT_MAX_PARALLEL_REQUESTS
+
+
+def _is_dropped(connection: HTTPConnection) -> bool:
+    """
+    @return: If the idle connection was closed by the server. This is found out before sending,
+     as a failed request may only be repeated if the server can't have received it.
+    """
+    if connection.sock is None:
+        return False  # = not connected yet
+
+    try:
+        readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (OSError, ValueError):
+        return True
+    return len(readable) > 0
+    #      ^ an idle connection only gets readable by being closed (or by an unexpected answer,
+    #         after which it isn't usable either)
+
+
+connection_pool = ConnectionPool()
+# shared by everything in this process which talks to the outside world via HTTP(S)
 
 
 class RequestHelper:
     """
     Encapsulates the recurring logic for sending out requests to the Dualis-System.
     """
+    host = DUALIS_HOST
+    is_secure = True
+    # can be pointed to a stand-in of the Dualis System, i.e. for benchmarks
+
     def __init__(self, token = '', cnsc = '0'):
-        self.connection = HTTPSConnection('dualis.dhbw.de')
         self.token = token
         self.stdHeader = {
             'Cookie': 'cnsc=' + cnsc,
@@ -22,13 +250,40 @@ class RequestHelper:
             # copied straight out of Chrome
         }
 
-    def get_ressource(self, programName: str, id: str = None) -> BeautifulSoup:
+    def get_ressource(self, programName: str, id: str = None, parse_only: SoupStrainer = None) -> BeautifulSoup:
         """
         Sends a GET-Request to the Dualis System
         @param programName: The name of the Dualis sub-program to call, as expected by PRGNAME.
         @param id: The optional id in the ARGUMENTS list for the sub-program.
+        @param parse_only: If given, only the matching parts of the response are parsed.
         @return: The response returned by the Dualis System, already checked for errors.
         """
+        response, body = self._send_get(programName, id, {})
+        return self._initial_parse(response, body, parse_only)
+
+    def get_ressource_if_modified(self, programName: str, id: str = None, validators: {str : str} = None,
+                                  parse_only: SoupStrainer = None) -> (BeautifulSoup, {str : str}):
+        """
+        Sends a conditional GET-Request to the Dualis System
+        @param programName: The name of the Dualis sub-program to call, as expected by PRGNAME.
+        @param id: The optional id in the ARGUMENTS list for the sub-program.
+        @param validators: The validators (`etag` and/or `last_modified`) of a previously fetched
+         version of the ressource.
+        @param parse_only: If given, only the matching elements of the response are parsed.
+        @return: Tuple with (the response returned by the Dualis System, already checked for errors,
+         or None if the ressource wasn't modified , the validators of the current version)
+        """
+        validators = validators or {}
+        response, body = self._send_get(programName, id, get_conditional_headers(validators))
+
+        if (response.getcode() == 304):
+            metrics.count('dualis.not_modified')
+            return None, validators
+
+        return self._initial_parse(response, body, parse_only), get_validators(response)
+
+    @metrics.timed('dualis.request')
+    def _send_get(self, programName: str, id: str, additional_headers: {str : str}) -> (HTTPResponse, bytes):
         if (self.token is None):
             raise ValueError('The required Token is not set!')
 
@@ -37,16 +292,20 @@ class RequestHelper:
         else:
             id_segment = ''
 
-        self.connection.request(
-            'GET',
+        headers = dict(self.stdHeader)
+        headers.update(additional_headers)
+
+        response, body = connection_pool.request(
+            self.host, 'GET',
             '/scripts/mgrqispi.dll?APPNAME=CampusNet&PRGNAME=%s&ARGUMENTS=-N%s,-N000019,%s'%(
                 programName, self.token, id_segment
             ),
-            headers=self.stdHeader
+            headers=headers, is_secure=self.is_secure
         )
-        
-        response = self.connection.getresponse()
-        return self._initial_parse(response)
+        metrics.count('dualis.requests')
+        metrics.count('dualis.received_bytes', len(body))
+
+        return response, body
 
     def post_raw(self, relative_url: str, data: object) -> (BeautifulSoup, HTTPResponse):
         """
@@ -57,23 +316,30 @@ class RequestHelper:
         """
         data_urlencoded = urllib.parse.urlencode(data)
 
-        self.connection.request(
-            'POST',
-            '/scripts/mgrqispi.dll%s'%(
-                relative_url
-            ),
-            body=data_urlencoded,
-            headers=self.stdHeader
-        )
+        with metrics.timer('dualis.login'):
+            # only the request itself, the parsing of the response is measured as `dualis.parse`
+            #  like for every other page, so the timers don't overlap
+            response, body = connection_pool.request(
+                self.host, 'POST',
+                '/scripts/mgrqispi.dll%s'%(
+                    relative_url
+                ),
+                body=data_urlencoded,
+                headers=self.stdHeader, is_secure=self.is_secure
+            )
 
-        response = self.connection.getresponse()
-        return self._initial_parse(response), response
+        return self._initial_parse(response, body), response
 
-    def _initial_parse(self, response):
+    @metrics.timed('dualis.parse')
+    def _initial_parse(self, response: HTTPResponse, body: bytes, parse_only: SoupStrainer = None):
         if (response.getcode() != 200):
             raise RuntimeError('An Unexpected Error happened on side of the Dualis System!')
 
-        response_soup = BeautifulSoup(response.read(), 'html.parser')
+        if (parse_only is not None and not page_parser.may_be_error_page(body)):
+            # = we can skip the checks for errors, which need the whole page
+            return page_parser.parse_page(body, parse_only)
+
+        response_soup = page_parser.parse_page(body)
 
         if (    response_soup.title is not None
             and response_soup.title.string == 'Execution Error'
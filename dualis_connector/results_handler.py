@@ -1,6 +1,19 @@
+import json
+import re
+from collections import Counter, namedtuple
+
+from bs4 import BeautifulSoup
+
+from dualis_connector import page_parser
 from dualis_connector.request_helper import RequestHelper
 
 
+ExamRecord = namedtuple('ExamRecord', ['attempt', 'exam', 'date', 'grade', 'status'])
+# One row of the table with the exams of a course. All fields are plain, whitespace-normalized text.
+
+_date_pattern = re.compile(r'\d{1,2}\.\d{1,2}\.\d{2,4}')
+
+
 class ResultsHandler:
     """
     Fetches and parses the various sites in Dualis which are related to course results.
@@ -11,7 +24,7 @@ class ResultsHandler:
         self.request_helper = request_helper
 
     def fetch_semesters(self) -> [str]:
-        page = self.request_helper.get_ressource('COURSERESULTS')
+        page = self.request_helper.get_ressource('COURSERESULTS', parse_only=page_parser.SEMESTER_LIST)
 
         results = []
         semester_entries = page.find('select', id='semester').findAll('option')
@@ -22,7 +35,7 @@ class ResultsHandler:
         return results
 
     def fetch_courses(self, semester_id: str) -> [str]:
-        page = self.request_helper.get_ressource('COURSERESULTS', semester_id)
+        page = self.request_helper.get_ressource('COURSERESULTS', semester_id, page_parser.COURSE_LIST)
 
         results = []
         course_entries = page.find('table', class_='nb list').find('tbody').findAll('tr')
@@ -42,11 +55,19 @@ class ResultsHandler:
 
         return results
 
-    def fetch_result(self, course_id: str) -> {str: (str , str)}:
-        page = self.request_helper.get_ressource('RESULTDETAILS', course_id)
-        name = extract_course_name_from_result_page(page)
+    def fetch_result(self, course_id: str, validators: {str : str} = {}) \
+            -> {str: (BeautifulSoup, str, {str : str})}:
+        """
+        @param validators: The validators of the previously fetched version of the result page, if
+         known. If the Dualis System confirms that the page didn't change, page and name are None.
+        @return: Dictionary with {course id : (page, name, validators of the page)}
+        """
+        page, new_validators = self.request_helper.get_ressource_if_modified(
+            'RESULTDETAILS', course_id, validators, page_parser.RESULT_DETAILS
+        )
+        name = extract_course_name_from_result_page(page) if page is not None else None
 
-        return { course_id : (page, name)}
+        return { course_id : (page, name, new_validators)}
 
 
 def extract_course_name_from_result_page(result_soup):
@@ -54,3 +75,118 @@ def extract_course_name_from_result_page(result_soup):
     name_filtered = name_raw.replace('\r', '').replace('\n', '').strip(' ')
 
     return name_filtered
+
+
+def extract_exam_records(result_soup) -> [ExamRecord]:
+    """
+    @return: The rows of the table with the exams of the course, in the order they are shown in.
+    """
+    result_table = result_soup.find('table', class_='tb')
+    if result_table is None:
+        return []
+
+    records = []
+    attempt = ''
+    for row in result_table.findAll('tr'):
+        cells = row.findAll('td')
+        texts = [' '.join(cell.get_text().split()) for cell in cells]
+        classes = [' '.join(cell.get('class', [])) for cell in cells]
+        if len(cells) == 0:
+            continue
+
+        if 'level02' in classes[0]:
+            # = the header of an attempt (e.g. 'Versuch 1'), all following exams belong to it
+            attempt = texts[0]
+        elif 'level00' in classes[0]:
+            # = the overall result of the course
+            records.append(ExamRecord(
+                attempt, texts[0], '', texts[1] if len(texts) > 1 else '', ' '.join(texts[2:])
+            ))
+        elif any(c.startswith('tbdata') for c in classes):
+            grade_index = next((i for i, c in enumerate(classes) if 'tbdata_numeric' in c), None)
+            dates = [text for text in texts if _date_pattern.fullmatch(text)]
+            records.append(ExamRecord(
+                attempt,
+                texts[1] if len(texts) > 1 else texts[0],
+                dates[0] if len(dates) > 0 else '',
+                texts[grade_index] if grade_index is not None else '',
+                ' '.join(text for text in texts[grade_index + 1:] if text) if grade_index is not None else ''
+            ))
+
+    return records
+
+
+def serialize_result(name: str, records: [ExamRecord]) -> str:
+    """
+    @return: The canonical representation of the result of a course, in which it is stored. Every
+     exam is on a line of its own, so changes can be tracked line by line.
+    """
+    record_lines = [
+        '  ' + json.dumps(record._asdict(), ensure_ascii=False, sort_keys=True) for record in records
+    ]
+    return '{\n "name": %s,\n "exams": [\n%s\n ]\n}\n'%(
+        json.dumps(name, ensure_ascii=False), ',\n'.join(record_lines)
+    )
+
+
+def deserialize_result(content: str) -> (str, [ExamRecord]):
+    """
+    Also understands the result pages, which were stored as a whole by former versions.
+    @return: Tuple with (course name , exam records)
+    """
+    if not content.lstrip().startswith('{'):
+        result_soup = BeautifulSoup(content, page_parser.EXACT_BACKEND)
+        return (extract_course_name_from_result_page(result_soup), extract_exam_records(result_soup))
+
+    raw = json.loads(content)
+    return (raw['name'], [ExamRecord(**raw_record) for raw_record in raw['exams']])
+
+
+def diff_results(old_content: str, new_content: str) -> [str]:
+    """
+    Compares two stored results exam by exam.
+    @return: The changed exams, with the changed fields marked like in a word-diff. Empty if the
+     results are equivalent.
+    """
+    old_name, old_records = deserialize_result(old_content)
+    new_name, new_records = deserialize_result(new_content)
+
+    def by_key(records: [ExamRecord]) -> {(str, str, int) : ExamRecord}:
+        # the same exam may occur more than once in an attempt, so they are counted
+        keyed = {}
+        occurrences = Counter()
+        for record in records:
+            occurrence = occurrences[(record.attempt, record.exam)]
+            occurrences[(record.attempt, record.exam)] += 1
+            keyed[(record.attempt, record.exam, occurrence)] = record
+        return keyed
+
+    old_keyed = by_key(old_records)
+    new_keyed = by_key(new_records)
+
+    lines = []
+    if old_name != new_name:
+        lines.append('[-%s-]{+%s+}'%(old_name, new_name))
+    for key in old_keyed:
+        if key not in new_keyed:
+            lines.append('[-%s-]'%(_format_record(old_keyed[key])))
+    for key, new_record in new_keyed.items():
+        old_record = old_keyed.get(key)
+        if old_record is None:
+            lines.append('{+%s+}'%(_format_record(new_record)))
+        elif old_record != new_record:
+            lines.append(' | '.join(
+                new_field if old_field == new_field else
+                ('[-%s-]'%(old_field) if old_field else '') + ('{+%s+}'%(new_field) if new_field else '')
+                for old_field, new_field in zip(old_record, new_record)
+                if old_field or new_field
+            ))
+
+    if len(lines) == 0:
+        return []
+
+    return ['\n'.join(lines) + '\n']
+
+
+def _format_record(record: ExamRecord) -> str:
+    return ' | '.join(field for field in record if field)
@@ -0,0 +1,214 @@
+"""
+Reports errors to Sentry without blocking the run: the errors are only put into a queue, the client
+is created and the reports are sent by a background thread.
+Recurring errors (i.e. while Dualis is down for hours) are only reported once per interval, and the
+number of reports per hour is limited. As every cron-triggered run is a process of its own, this
+state is kept in a file. It is written by the background thread as well, merged with the changes
+of other processes which ran at the same time.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+from file_helper import write_atomically
+
+DEFAULT_MIN_INTERVAL_MINUTES = 6 * 60
+# how long the same error isn't reported again
+DEFAULT_MAX_REPORTS_PER_HOUR = 10
+FLUSH_TIMEOUT_SECONDS = 10
+# how long the end of the process is delayed at most for the reports which are still queued
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def compute_fingerprint(exc_info: tuple) -> str:
+    """
+    @return: A fingerprint of the error, which is the same for all occurrences of it, independent
+     of the numbers (like ids or status codes) in its message.
+    """
+    error_type, error, error_traceback = exc_info
+    frames = [
+        '%s:%s'%(os.path.basename(frame.filename), frame.name)
+        for frame in traceback.extract_tb(error_traceback)
+    ]
+    message = re.sub(r'\d+', '#', str(error))
+    return hashlib.sha1(
+        '\n'.join([error_type.__name__, message] + frames).encode('utf-8', 'backslashreplace')
+    ).hexdigest()
+
+
+class ErrorReporter:
+    def __init__(self, sentry_dsn: str, state_file_name: str = 'error_reports.json',
+                 min_interval_minutes: float = DEFAULT_MIN_INTERVAL_MINUTES,
+                 max_reports_per_hour: int = DEFAULT_MAX_REPORTS_PER_HOUR):
+        self.sentry_dsn = sentry_dsn
+        self.state_file_name = state_file_name
+        self.min_interval = timedelta(minutes=min_interval_minutes)
+        self.max_reports_per_hour = max_reports_per_hour
+
+        self._client = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        self._state = self._load()
+        # {'errors': {fingerprint : {'last_reported_at': .. , 'suppressed': ..}} , 'reported_at': [..]}
+        self._suppressed_since_save = {}  # {fingerprint : count}, to be added to the state on disk
+        self._reported_at_since_save = []
+        self._is_dirty = False
+        atexit.register(self.flush)
+
+    def report(self, exc_info: tuple) -> bool:
+        """
+        Queues the given error for being reported, unless it was reported recently or too many
+         errors were reported in the last hour.
+        @param exc_info: The error, as returned by sys.exc_info().
+        @return: If the error is going to be reported.
+        """
+        fingerprint = compute_fingerprint(exc_info)
+        now = datetime.now()
+
+        with self._lock:
+            self._state['reported_at'] = [
+                reported_at for reported_at in self._state['reported_at']
+                if datetime.strptime(reported_at, TIME_FORMAT) > now - timedelta(hours=1)
+            ]
+            error_state = self._state['errors'].setdefault(fingerprint, {'last_reported_at': None, 'suppressed': 0})
+
+            is_recent = (
+                    error_state['last_reported_at'] is not None
+                and datetime.strptime(error_state['last_reported_at'], TIME_FORMAT) > now - self.min_interval
+            )
+            if is_recent or len(self._state['reported_at']) >= self.max_reports_per_hour:
+                # = only written with the next report or at the end of the process, suppressing must
+                #    be cheap while an error recurs
+                error_state['suppressed'] += 1
+                self._suppressed_since_save[fingerprint] = self._suppressed_since_save.get(fingerprint, 0) + 1
+                self._is_dirty = True
+                logging.debug('Error %s was reported recently, it is not reported again.'%(fingerprint))
+                return False
+
+            suppressed_count = error_state['suppressed']
+            error_state['last_reported_at'] = now.strftime(TIME_FORMAT)
+            error_state['suppressed'] = 0
+            self._state['reported_at'].append(now.strftime(TIME_FORMAT))
+            self._reported_at_since_save.append(now.strftime(TIME_FORMAT))
+            self._suppressed_since_save.pop(fingerprint, None)
+            self._drop_expired(now)
+            self._is_dirty = True
+
+            self._queue.put((exc_info, fingerprint, suppressed_count))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._send_queued, name='ErrorReporter', daemon=True)
+                self._thread.start()
+
+        return True
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT_SECONDS):
+        """
+        Waits until the queued reports are sent, but at most for the given time, and saves the
+         state.
+        """
+        if self._thread is not None:
+            finished = threading.Event()
+            self._queue.put(finished)
+            finished.wait(timeout)
+        self._save_if_dirty()
+
+    def _send_queued(self):
+        while True:
+            item = self._queue.get()
+            self._save_if_dirty()
+            if isinstance(item, threading.Event):
+                item.set()
+                continue
+
+            exc_info, fingerprint, suppressed_count = item
+            try:
+                # the client sends synchronously, so once the queue is processed, the reports
+                #  really arrived
+                self._get_client().captureException(
+                    exc_info=exc_info, fingerprint=[fingerprint],
+                    extra={'suppressed_since_last_report': suppressed_count}
+                )
+            except BaseException:
+                logging.error('Error while reporting an error to Sentry:\n%s'%(traceback.format_exc()))
+
+    def _get_client(self):
+        # raven is only imported once an error has to be reported, as that is expensive and not
+        #  needed in most runs
+        if self._client is None:
+            from raven import fetch_git_sha
+            from raven.handlers.logging import Client as RavenClient
+            from raven.transport.http import HTTPTransport
+
+            self._client = RavenClient(
+                self.sentry_dsn,
+                transport=HTTPTransport,
+                #         ^ instead of the threaded default, whose own thread may be stopped at the
+                #            end of the process before this one got to send
+                auto_log_stacks=True,
+                release=fetch_git_sha(os.path.dirname(__file__))
+            )
+        return self._client
+
+    def _drop_expired(self, now: datetime):
+        # errors which weren't seen for a long time are forgotten, so the file doesn't grow forever
+        self._state['errors'] = {
+            fingerprint : error_state for fingerprint, error_state in self._state['errors'].items()
+            if error_state['last_reported_at'] is None
+            or datetime.strptime(error_state['last_reported_at'], TIME_FORMAT) > now - 4 * self.min_interval
+        }
+
+    def _load(self) -> {str : any}:
+        try:
+            with open(self.state_file_name, 'r') as f:
+                state = json.loads(f.read())
+        except (IOError, ValueError):
+            state = {}
+        state.setdefault('errors', {})
+        state.setdefault('reported_at', [])
+        return state
+
+    def _save_if_dirty(self):
+        try:
+            with self._lock:
+                if self._is_dirty:
+                    self._save()
+        except BaseException:
+            logging.error('Error while saving the state of the error reports:\n%s'%(traceback.format_exc()))
+
+    def _save(self):
+        # Other processes (i.e. a manual run next to the daemon) may have changed the file since it
+        #  was loaded, so their changes are merged in: the later report of an error wins, otherwise
+        #  the suppressions of this process are added to theirs.
+        state = self._load()
+        for fingerprint, error_state in self._state['errors'].items():
+            saved_error_state = state['errors'].get(fingerprint)
+            if saved_error_state is None or _is_later(error_state['last_reported_at'], saved_error_state['last_reported_at']):
+                state['errors'][fingerprint] = error_state
+            else:
+                saved_error_state['suppressed'] += self._suppressed_since_save.get(fingerprint, 0)
+        state['reported_at'] = sorted(state['reported_at'] + self._reported_at_since_save)
+        self._state = state
+        self._drop_expired(datetime.now())
+
+        write_atomically(self.state_file_name, json.dumps(self._state))
+
+        self._suppressed_since_save = {}
+        self._reported_at_since_save = []
+        self._is_dirty = False
+
+
+def _is_later(time: str, other_time: str) -> bool:
+    if time is None:
+        return False
+    return other_time is None or datetime.strptime(time, TIME_FORMAT) > datetime.strptime(other_time, TIME_FORMAT)
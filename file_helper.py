@@ -0,0 +1,43 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # = on Windows, where files are not locked between processes
+
+
+def write_atomically(path: str, content: str):
+    """
+    Writes the content into a temporary file next to the given path first and then moves it into
+     place, so the file is never left half-written and readers (also other processes, i.e. the
+     node_exporter) never see a half-written one.
+    """
+    dir_name, file_name = os.path.split(path)
+    temp_path = os.path.join(dir_name, '.%s.%s-%s.tmp'%(file_name, os.getpid(), threading.get_ident()))
+    #                                   ^ hidden, so it is never taken for a recorded file, and unique per
+    #                                      thread, so threads or processes saving at the same time don't
+    #                                      write into the same file
+    with open(temp_path, encoding='utf-8', errors='backslashreplace', mode='w', newline='') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+
+@contextmanager
+def locked(path: str):
+    """
+    Holds an exclusive lock on the given path (a separate lock file, which is created if needed)
+     while the block is executed, so processes which read, change and write the same file don't
+     overwrite the changes of each other. It doesn't keep apart the threads of one process.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+
+from file_helper import write_atomically
+
+
+class FingerprintCache:
+    """
+    Remembers a fingerprint (and optionally further attributes like HTTP-validators) of the last
+    persisted content of each entry, so unchanged entries can be recognized without processing them
+    again.
+
+    New fingerprints are only staged at first. They have to be committed as soon as the content they
+    represent is persisted, otherwise a not yet persisted change would be skipped in the next run.
+    """
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._entries = {}
+        self._staged_entries = {}
+
+        try:
+            with open(file_name, 'r') as f:
+                self._entries = json.loads(f.read())
+        except (IOError, ValueError):
+            # = there is no (valid) cache yet, so every entry will be processed normally
+            self._entries = {}
+
+    @staticmethod
+    def compute(content: str) -> str:
+        return hashlib.sha256(content.encode('utf-8', 'backslashreplace')).hexdigest()
+
+    def get(self, entry_id: str) -> {str : str}:
+        """
+        @return: The persisted attributes of the entry or an empty dictionary if it is unknown.
+        """
+        return self._entries.get(entry_id, {})
+
+    def matches(self, entry_id: str, fingerprint: str) -> bool:
+        return self.get(entry_id).get('fingerprint') == fingerprint
+
+    def stage(self, entry_id: str, **attributes):
+        staged_entry = dict(self._staged_entries.get(entry_id, self.get(entry_id)))
+        staged_entry.update(attributes)
+        self._staged_entries[entry_id] = staged_entry
+
+    def commit(self, entry_ids: [str] = None):
+        """
+        Persists the staged attributes.
+        @param entry_ids: Only commit the staged attributes of these entries. All if not given.
+        """
+        if entry_ids is None:
+            entry_ids = list(self._staged_entries.keys())
+
+        for entry_id in entry_ids:
+            if entry_id in self._staged_entries:
+                self._entries[entry_id] = self._staged_entries.pop(entry_id)
+
+        self._save()
+
+    def retain_only(self, entry_ids: [str]):
+        """
+        Forgets all entries which are not contained in the given ones.
+        """
+        entry_ids = set(entry_ids)
+        self._entries = { k : v for k, v in self._entries.items() if k in entry_ids }
+        self._staged_entries = { k : v for k, v in self._staged_entries.items() if k in entry_ids }
+        self._save()
+
+    def _save(self):
+        write_atomically(self.file_name, json.dumps(self._entries, indent=4, sort_keys=True))
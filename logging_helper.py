@@ -0,0 +1,270 @@
+"""
+Sets up the logging of the program. The records are only put into a queue by the threads which log
+them, they are formatted and written into the (rotated) log file by a background thread.
+Which records get written can be configured per subsystem (= module path, i.e.
+`dualis_connector.request_helper`), by a level and a sampling rate. Repeated identical errors are
+only written once in a while, together with the number of their repetitions.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from datetime import datetime
+
+from config_helper import ConfigHelper
+
+DEFAULT_FILE_NAME = 'DualisWatcher.log'
+DEFAULT_FORMAT = 'text'
+DEFAULT_LEVEL = 'DEBUG'
+DEFAULT_MAX_MEGABYTES = 10
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_DEDUP_MINUTES = 60
+
+TEXT_FORMAT = '%(asctime)s  %(levelname)s  {%(module)s}  %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_queue_handler = None
+_listener = None
+
+
+def get_subsystem(record: logging.LogRecord) -> str:
+    """
+    @return: The module path of the code which logged the record, relative to the root of the
+     project, i.e. `dualis_connector.request_helper`.
+    """
+    path = os.path.relpath(os.path.splitext(record.pathname)[0], _ROOT_DIR)
+    if path.startswith('..'):
+        return record.name  # = logged by a library
+
+    return path.replace(os.sep, '.')
+
+
+def _find_by_prefix(values: {str : any}, subsystem: str, default: any) -> any:
+    # the most specific entry wins, i.e. `dualis_connector.request_helper` over `dualis_connector`
+    matching_keys = [
+        key for key in values
+        if subsystem == key or subsystem.startswith(key + '.')
+    ]
+    if len(matching_keys) == 0:
+        return default
+    return values[max(matching_keys, key=len)]
+
+
+class SubsystemFilter(logging.Filter):
+    """
+    Drops the records below the level of their subsystem, and samples the remaining ones below
+     WARNING with the sampling rate of their subsystem.
+    """
+    def __init__(self, default_level: int, levels: {str : int}, sampling_rates: {str : float}):
+        super().__init__()
+        self.default_level = default_level
+        self.levels = levels
+        self.sampling_rates = sampling_rates
+        self._subsystems = {}  # {pathname : subsystem}, as the same modules log over and over again
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        subsystem = self._subsystems.get(record.pathname)
+        if subsystem is None:
+            subsystem = self._subsystems[record.pathname] = get_subsystem(record)
+        record.subsystem = subsystem
+
+        if record.levelno < _find_by_prefix(self.levels, subsystem, self.default_level):
+            return False
+
+        if record.levelno < logging.WARNING:
+            sampling_rate = _find_by_prefix(self.sampling_rates, subsystem, 1.0)
+            if sampling_rate < 1.0 and random.random() >= sampling_rate:
+                return False
+
+        return True
+
+
+class DeduplicationFilter(logging.Filter):
+    """
+    Drops errors which were already logged in the last `window_seconds`. The next one which gets
+     through carries the number of the dropped repetitions in `record.repeated`.
+    Errors which weren't written for longer than the window are forgotten, so a long running daemon
+     doesn't collect every message it ever logged. Their dropped repetitions are lost then.
+    """
+    def __init__(self, window_seconds: float):
+        super().__init__()
+        self.window_seconds = window_seconds
+        self._last_seen = {}  # {message : [time it was last written , dropped repetitions since]}
+        # ^ ordered by the time the messages were last written, so the oldest ones come first
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.ERROR or self.window_seconds <= 0:
+            return True
+
+        message = '%s:%s'%(record.pathname, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            last_seen = self._last_seen.get(message)
+            if last_seen is not None and now - last_seen[0] < self.window_seconds:
+                last_seen[1] += 1
+                return False
+
+            record.repeated = last_seen[1] if last_seen is not None else 0
+            self._last_seen.pop(message, None)
+            self._last_seen[message] = [now, 0]  # = moved to the end, as it is the latest one
+
+            # forgets the messages which weren't written within the window, the loop stops at the
+            #  one which was just written at the latest
+            oldest_message = next(iter(self._last_seen))
+            while now - self._last_seen[oldest_message][0] >= self.window_seconds:
+                del self._last_seen[oldest_message]
+                oldest_message = next(iter(self._last_seen))
+            return True
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats every record as a single line of JSON.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3],
+            'level': record.levelname,
+            'subsystem': getattr(record, 'subsystem', record.name),
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'repeated', 0) > 0:
+            entry['repeated'] = record.repeated
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _RecordKeepingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Merges the arguments into the message like the QueueHandler, but keeps the exception of the
+     record, as the formatters need it and the queue never leaves the process anyway.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT, DATE_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        formatted = super().format(record)
+        if getattr(record, 'repeated', 0) > 0:
+            formatted += '  (repeated %s times since it was logged last)'%(record.repeated)
+        return formatted
+
+
+def _parse_level(name: str, default: int, description: str, warnings: [str]) -> int:
+    """
+    @param warnings: Gets a message appended if the name is unknown, to be logged once the logging
+     is set up.
+    """
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        # = getLevelName returns a text for unknown names instead of failing
+        warnings.append('Unknown logging level `%s` for %s, using %s instead.'%(
+            name, description, logging.getLevelName(default)
+        ))
+        return default
+    return level
+
+
+def setup_logging(config_helper: ConfigHelper = None, file_name: str = None):
+    """
+    Routes all logging through a queue into the rotated log file, as configured in the `logging`
+     property of the config, i.e.
+     `{"format": "jsonl", "levels": {"dualis_connector": "INFO"}, "sampling": {"dualis_connector.request_helper": 0.1}}`
+    @param config_helper: An already loaded config. If not given, the defaults are used.
+    """
+    global _queue_handler, _listener
+
+    logging_cfg = {}
+    if config_helper is not None:
+        try:
+            logging_cfg = config_helper.get_property('logging')
+        except ValueError:
+            pass
+
+    file_name = file_name or logging_cfg.get('file', DEFAULT_FILE_NAME)
+    if logging_cfg.get('rotate_when'):
+        # i.e. `midnight`, see logging.handlers.TimedRotatingFileHandler
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            file_name, when=logging_cfg['rotate_when'], encoding='utf-8',
+            backupCount=int(logging_cfg.get('backup_count', DEFAULT_BACKUP_COUNT))
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            file_name, encoding='utf-8',
+            maxBytes=int(float(logging_cfg.get('max_megabytes', DEFAULT_MAX_MEGABYTES)) * 1024 * 1024),
+            backupCount=int(logging_cfg.get('backup_count', DEFAULT_BACKUP_COUNT))
+        )
+
+    if logging_cfg.get('format', DEFAULT_FORMAT) == 'jsonl':
+        file_handler.setFormatter(JsonLinesFormatter())
+    else:
+        file_handler.setFormatter(TextFormatter())
+
+    warnings = []
+    default_level = _parse_level(
+        logging_cfg.get('level', DEFAULT_LEVEL), logging.getLevelName(DEFAULT_LEVEL), 'the log', warnings
+    )
+    levels = {
+        subsystem : _parse_level(level, default_level, '`%s`'%(subsystem), warnings)
+        for subsystem, level in logging_cfg.get('levels', {}).items()
+    }
+    sampling_rates = {
+        subsystem : float(rate) for subsystem, rate in logging_cfg.get('sampling', {}).items()
+    }
+
+    # The filters are applied by the logging thread itself, so the dropped records are never even
+    #  put into the queue. Everything else (like the formatting) is done by the listener.
+    queue_handler = _RecordKeepingQueueHandler(queue.Queue(-1))
+    queue_handler.addFilter(SubsystemFilter(default_level, levels, sampling_rates))
+    queue_handler.addFilter(DeduplicationFilter(
+        float(logging_cfg.get('dedup_minutes', DEFAULT_DEDUP_MINUTES)) * 60
+    ))
+
+    root_logger = logging.getLogger()
+    if _listener is not None:
+        # = set up before, the old records are written out and replaced
+        root_logger.removeHandler(_queue_handler)
+        _listener.stop()
+    root_logger.setLevel(min([default_level] + list(levels.values())))
+    root_logger.addHandler(queue_handler)
+
+    _queue_handler = queue_handler
+    _listener = logging.handlers.QueueListener(queue_handler.queue, file_handler)
+    _listener.start()
+
+    for warning in warnings:
+        logging.warning(warning)
+
+def stop_logging():
+    """
+    Writes out the records which are still queued.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -3,18 +3,36 @@
 
 import logging
 import os
+import random
+import signal
 import sys
+import threading
+import time
 import traceback
 import json
-
-from raven import fetch_git_sha
-from raven.handlers.logging import Client as RavenClient
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 from config_helper import ConfigHelper
 from dhbw_ma_schedule_connector.schedule_service import ScheduleService
 from dualis_connector.dualis_service import DualisService
-from dualis_connector.request_helper import DualisSleepingError
+from dualis_connector.night_window import NightWindow
+from dualis_connector.request_helper import DualisSleepingError, DUALIS_HOST, connection_pool
+from error_reporter import ErrorReporter
 from notification_services.mail.mail_service import MailService
+from notification_services.notification_dispatcher import NotificationDispatcher
+from notification_services.notification_service import NotificationService
+import logging_helper
+import metrics
+import startup_profiler
+
+
+DEFAULT_MAX_PARALLEL_ACCOUNTS = 4
+DEFAULT_MAX_PARALLEL_DUALIS_REQUESTS = 8
+DEFAULT_DAEMON_INTERVAL_MINUTES = 15
+DEFAULT_DAEMON_JITTER_MINUTES = 1
+MAX_DAEMON_SLEEPING_BACKOFF_MINUTES = 60
+MIN_DAEMON_DELAY_SECONDS = 10
 
 
 class ReRaiseOnError(logging.StreamHandler):
@@ -39,7 +57,7 @@ def run_init():
         if do_override_input == 'n':
             sys.exit(0)
 
-    MailService(config).interactively_configure()
+    NotificationDispatcher(config).interactively_configure()
 
     raw_do_sentry = ''
     while raw_do_sentry not in ['y', 'n']:
@@ -75,10 +93,7 @@ def run_new_token(email='', password=''):
     config = ConfigHelper()
     config.load()  # because we do not want to override the other settings
 
-    logging.basicConfig(
-        filename='DualisWatcher.log', level=logging.DEBUG,
-        format='%(asctime)s  %(levelname)s  {%(module)s}  %(message)s', datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    logging_helper.setup_logging(config)
 
     logging.info('--- run_new_token started ---------------------')
 
@@ -106,23 +121,277 @@ def run_change_notification_mail():
     config = ConfigHelper()
     config.load()
 
-    MailService(config).interactively_configure()
+    NotificationDispatcher(config).interactively_configure()
 
     print('Configuration successfully updated!')
 
-def run_main():
-    logging.basicConfig(
-        filename='DualisWatcher.log', level=logging.DEBUG,
-        format='%(asctime)s  %(levelname)s  {%(module)s}  %(message)s', datefmt='%Y-%m-%d %H:%M:%S'
+def run_add_account(name: str):
+    config = ConfigHelper()
+    config.load()
+
+    account_config = config.add_account(name)
+    account_dir = _account_dir(name)
+
+    try:
+        config.get_property('mail')
+    except ValueError:
+        pass  # = no mail notifications configured at all
+    else:
+        target = ''
+        while target == '':
+            target = input('E-Mail-Address of the Target for this Account:   ')
+        account_config.set_property('mail', {'target': target})
+
+    dualis = DualisService(account_config, os.path.join(account_dir, '_course-results'))
+    dualis.interactively_acquire_token()
+
+    schedule = ScheduleService(account_config, os.path.join(account_dir, '_schedule'))
+    is_schedule_activated = schedule.interactively_configure()
+
+    print('Account %s added!'%(name))
+
+    print('Fetching current states as base...')
+    dualis.fetch_and_save_unchecked_state()
+    if is_schedule_activated:
+        schedule.fetch_and_save_unchecked_state()
+    print('done!')
+
+def run_remove_account(name: str):
+    config = ConfigHelper()
+    config.load()
+
+    config.remove_account(name)
+    print(
+        'Account %s removed! Its saved states in `%s` were kept, delete them manually if you want to.'%(
+            name, _account_dir(name)
+        )
     )
 
-    logging.info('--- main started ---------------------')
-    if IS_DEBUG:
-        logging.info('Debug-Mode detected. Errors will not be logged but instead re-risen.')
-        debug_logger = logging.getLogger()
-        debug_logger.setLevel(logging.ERROR)
-        debug_logger.addHandler(ReRaiseOnError())
+def _account_dir(name: str) -> str:
+    return os.path.join('_accounts', name)
 
+
+class Watcher:
+    """
+    Bundles the services which watch one Dualis-Account (and its schedule), so they can be kept
+    alive between multiple checks.
+    """
+    def __init__(self, config: ConfigHelper, recorder_dir: str = '',
+                 label: str = 'the configured Dualis-Account', error_reporter: ErrorReporter = None):
+        """
+        @param recorder_dir: The directory in which the states of the account are recorded.
+        @param label: How the account is referred to in the log.
+        @param error_reporter: Where errors while delivering the notifications are reported, if a
+         check failed as well.
+        """
+        self.label = label
+        self.error_reporter = error_reporter
+        self.notifier = NotificationDispatcher(config)
+        self.dualis = DualisService(config, os.path.join(recorder_dir, '_course-results'))
+        self.schedule = ScheduleService(config, os.path.join(recorder_dir, '_schedule'))
+
+    def check_for_changes(self):
+        """
+        Checks for changes in the results of the Dualis-Account and its schedule and notifies about them.
+        The notifications are only queued during the checks, so each new state can be saved right
+         away, and they are delivered at the end (together with the ones which failed before).
+        """
+        try:
+            self._check_for_changes()
+        except BaseException:
+            # The notifications are delivered anyway. An error of their delivery (i.e. about dropped
+            #  ones) is reported on its own, it must not replace the error of the check.
+            try:
+                self._deliver_pending()
+            except BaseException as e:
+                logging.error('Error while delivering the notifications for %s!'%(self.label))
+                try:
+                    report_error(e, self.error_reporter, self.notifier)
+                except BaseException:
+                    logging.error(
+                        'Error while reporting the error for %s:\n%s'%(self.label, traceback.format_exc())
+                    )
+            raise
+        self._deliver_pending()
+
+    def _deliver_pending(self):
+        with metrics.timer('run.deliver'):
+            self.notifier.deliver_pending()
+
+    def _check_for_changes(self):
+        try:
+            self._check_results()
+        finally:
+            # The schedules are shared with the other accounts, and a new state of them is only
+            #  persisted once every account which got its changes saved it. So they are also checked
+            #  if the results couldn't be, otherwise this account would miss their changes.
+            if self.schedule.is_activated:
+                self._check_schedules()
+
+    def _check_results(self):
+        logging.debug('Checking for changes for %s....'%(self.label))
+        with metrics.timer('run.results'):
+            results = self.dualis.fetch_and_check_state()
+            changes = results[0]
+            course_names = results[1]
+
+            if changes.diff_count > 0:
+                logging.info('%s changes found for %s.'%(changes.diff_count, self.label))
+                metrics.count('changes.results', changes.diff_count)
+                self.notifier.notify_about_changes_in_results(changes, course_names)
+                self.dualis.save_state()
+            else:
+                logging.info('No changes found for %s.'%(self.label))
+
+    def _check_schedules(self):
+        logging.debug('Checking for changes for the Schedules of %s...'%(self.label))
+        with metrics.timer('run.schedule'):
+            for uid, changes in self.schedule.fetch_and_check_state().items():
+                if len(changes) > 0:
+                    logging.info('%s changes found for the Schedule %s of %s.' % (len(changes) - 1, uid, self.label))
+                    metrics.count('changes.schedule', len(changes) - 1)
+                    self.notifier.notify_about_changes_in_schedule(changes, uid)
+                    self.schedule.save_state(uid)
+                else:
+                    logging.info('No changes found for the Schedule %s of %s.'%(uid, self.label))
+
+
+def create_watchers(config: ConfigHelper, error_reporter: ErrorReporter) -> ([Watcher], bool):
+    """
+    Sets up a Watcher for the main account (if configured) and one for every additional account.
+    Errors while setting up an account (i.e. an unknown notifier or a recorder directory which can't
+     be created) are reported like the ones of a check, the other accounts are watched anyway.
+    @return: Tuple with (the Watchers of all accounts which could be set up , if any error occurred)
+    """
+    try:
+        max_parallel_dualis_requests = int(config.get_property('max_parallel_dualis_requests'))
+    except ValueError:
+        max_parallel_dualis_requests = DEFAULT_MAX_PARALLEL_DUALIS_REQUESTS
+    connection_pool.limit_host(DUALIS_HOST, max(1, max_parallel_dualis_requests))
+
+    accounts = [
+        (config.get_account_config(name), _account_dir(name), 'the Dualis-Account %s'%(name))
+        for name in config.get_account_names()
+    ]
+    try:
+        config.get_property('token')
+    except ValueError:
+        pass  # = only the additional accounts are configured
+    else:
+        accounts.insert(0, (config, '', 'the configured Dualis-Account'))
+
+    watchers = []
+    has_errors = False
+    for account_config, recorder_dir, label in accounts:
+        try:
+            watchers.append(Watcher(account_config, recorder_dir, label, error_reporter))
+        except BaseException as e:
+            has_errors = True
+            logging.error('Error while setting up %s!'%(label))
+            try:
+                report_error(e, error_reporter, _get_fallback_notifier(account_config))
+            except BaseException:
+                logging.error('Error while reporting the error for %s:\n%s'%(label, traceback.format_exc()))
+
+    return watchers, has_errors
+
+def _get_fallback_notifier(config: ConfigHelper) -> NotificationService:
+    """
+    @return: The configured notifiers, or the mail if they themselves can't be set up.
+    """
+    try:
+        return NotificationDispatcher(config)
+    except ValueError:
+        return MailService(config)
+
+def report_error(error: BaseException, error_reporter: ErrorReporter, notifier: NotificationService):
+    error_formatted = traceback.format_exc()
+    logging.error(error_formatted, extra={'exception':error})
+
+    if error_reporter:
+        error_reporter.report(sys.exc_info())  # = only queued, it is sent in the background
+
+    notifier.notify_about_error(str(error))
+    with metrics.timer('run.deliver'):
+        notifier.deliver_pending()
+
+def check_all_for_changes(config: ConfigHelper, watchers: [Watcher], error_reporter: ErrorReporter,
+                          has_setup_errors: bool = False) -> (bool, bool):
+    """
+    Lets all watchers check for changes in parallel. An error while checking one account doesn't
+     affect the others. Afterwards the metrics of the run are reported.
+    @param has_setup_errors: If setting up any of the accounts failed, which counts as an error of
+     the run.
+    @return: Tuple with (if Dualis is sleeping , if any error occurred)
+    """
+    metrics.reset()
+    start = time.time()
+
+    try:
+        max_parallel_accounts = int(config.get_property('max_parallel_accounts'))
+    except ValueError:
+        max_parallel_accounts = DEFAULT_MAX_PARALLEL_ACCOUNTS
+
+    def check(watcher: Watcher) -> (bool, bool):
+        try:
+            watcher.check_for_changes()
+        except DualisSleepingError:
+            return True, False
+        except BaseException as e:
+            logging.error('Error while checking %s!'%(watcher.label))
+            try:
+                report_error(e, error_reporter, watcher.notifier)
+            except BaseException:
+                logging.error(
+                    'Error while reporting the error for %s:\n%s'%(watcher.label, traceback.format_exc())
+                )
+            return False, True
+        return False, False
+
+    if len(watchers) == 1:
+        results = [check(watchers[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel_accounts)) as executor:
+            results = list(executor.map(check, watchers))
+
+    is_sleeping = any(result[0] for result in results)
+    has_errors = has_setup_errors or any(result[1] for result in results)
+    _report_metrics(config, start, len(watchers), is_sleeping, has_errors)
+
+    return is_sleeping, has_errors
+
+def _report_metrics(config: ConfigHelper, start: float, account_count: int, is_sleeping: bool, has_errors: bool):
+    """
+    Logs the metrics of the run as a JSON summary line and, if configured, writes them into a
+     file for the textfile-collector of the Prometheus node_exporter.
+    """
+    run_values = {
+        'timestamp_seconds': round(start, 3),
+        'duration_seconds': round(time.time() - start, 3),
+        'accounts': account_count,
+        'success': int(not is_sleeping and not has_errors),
+        'sleeping': int(is_sleeping),
+    }
+    logging.info('Run summary: %s'%(metrics.summary_line(run_values)))
+
+    try:
+        textfile_path = config.get_property('metrics')['prometheus_textfile']
+    except (ValueError, KeyError):
+        return
+    try:
+        metrics.write_prometheus_textfile(textfile_path, run_values)
+    except OSError:
+        logging.error('Error while writing the metrics to %s:\n%s'%(textfile_path, traceback.format_exc()))
+
+def _setup_logging():
+    config = ConfigHelper()
+    try:
+        config.load()
+    except ValueError:
+        config = None  # = logged with the defaults, the missing config is reported afterwards
+    logging_helper.setup_logging(config)
+
+def _load_config_and_error_reporter() -> (ConfigHelper, ErrorReporter):
     try:
         logging.debug('Loading config...')
         config = ConfigHelper()
@@ -131,62 +400,144 @@ def run_main():
         logging.error('Error while trying to load the Configuration! Exiting...', extra={'exception':e})
         sys.exit(-1)
 
-    r_client = None
+    error_reporter = None
     try:
         sentry_dsn = config.get_property('sentry_dsn')
         if sentry_dsn:
-            r_client = RavenClient(
-                sentry_dsn,
-                auto_log_stacks=True,
-                release=fetch_git_sha(os.path.dirname(__file__))
-            )
+            error_reporter = ErrorReporter(sentry_dsn, **_get_error_reporting_limits(config))
     except BaseException:
         pass
 
-    mail_service = MailService(config)
+    return config, error_reporter
 
+def _get_error_reporting_limits(config: ConfigHelper) -> {str : float}:
+    limits = {}
+    try:
+        limits['min_interval_minutes'] = float(config.get_property('sentry_min_interval_minutes'))
+    except ValueError:
+        pass
     try:
-        dualis = DualisService(config)
+        limits['max_reports_per_hour'] = int(config.get_property('sentry_max_reports_per_hour'))
+    except ValueError:
+        pass
+    return limits
 
-        logging.debug('Checking for changes for the configured Dualis-Account....')
-        results = dualis.fetch_and_check_state()
-        changes = results[0]
-        course_names = results[1]
+def run_main():
+    _setup_logging()
 
-        if changes.diff_count > 0:
-            logging.info('%s changes found for the configured Dualis-Account.'%(changes.diff_count))
-            mail_service.notify_about_changes_in_results(changes, course_names)
-            dualis.save_state()
-        else:
-            logging.info('No changes found for the configured Dualis-Account.')
-
-        schedule = ScheduleService(config)
-        if schedule.is_activated:
-            logging.debug('Checking for changes for the configured Schedule...')
-            changes = schedule.fetch_and_check_state()
-            if len(changes) > 0:
-                logging.info('%s changes found for the configured Schedule.' % (len(changes) - 1) )
-                mail_service.notify_about_changes_in_schedule(changes, schedule.uid)
-                schedule.save_state()
-            else:
-                logging.info('No changes found for the configured Schedule.')
+    logging.info('--- main started ---------------------')
+    if IS_DEBUG:
+        logging.info('Debug-Mode detected. Errors will not be logged but instead re-risen.')
+        debug_logger = logging.getLogger()
+        debug_logger.setLevel(logging.ERROR)
+        debug_logger.addHandler(ReRaiseOnError())
 
-        logging.debug('All done. Exiting...')
-    except DualisSleepingError:
+    config, error_reporter = _load_config_and_error_reporter()
+
+    night_window = NightWindow()
+    if night_window.is_inside() and not night_window.is_probe_due():
+        logging.info(
+            'Dualis is expected to be sleeping until %s, skipping this run.'%(
+                night_window.predicted_wake_up().strftime('%H:%M')
+            )
+        )
+        return
+
+    watchers, has_setup_errors = create_watchers(config, error_reporter)
+    is_sleeping, has_errors = check_all_for_changes(config, watchers, error_reporter, has_setup_errors)
+    _record_observation(night_window, is_sleeping, has_errors)
+
+    if is_sleeping:
         logging.info('Dualis is sleeping, exiting and soon trying again.')
         sys.exit(-1)
-    except BaseException as e:
-        error_formatted = traceback.format_exc()
-        logging.error(error_formatted, extra={'exception':e})
+    elif has_errors:
+        logging.debug('Exception-Handling completed. Exiting...')
+        sys.exit(-1)
+    else:
+        logging.debug('All done. Exiting...')
 
-        if r_client:
-            r_client.captureException(exec_info=True)
+def _record_observation(night_window: NightWindow, is_sleeping: bool, has_errors: bool):
+    if is_sleeping:
+        night_window.record_sleeping()
+    elif not has_errors:
+        night_window.record_awake()
+    # (if errors occurred, we don't know if Dualis was awake)
 
-        mail_service.notify_about_error(str(e))
+def run_status():
+    print(NightWindow().describe())
 
-        logging.debug('Exception-Handling completed. Exiting...', extra={'exception' : e})
+def run_profile_startup():
+    config = ConfigHelper()
+    try:
+        config.load()
+        budget_ms = config.get_property('startup_budget_ms')
+    except ValueError:
+        budget_ms = None
+
+    is_within_budget = startup_profiler.print_profile(os.path.realpath(__file__), budget_ms)
+    if not is_within_budget:
         sys.exit(-1)
 
+def run_daemon():
+    _setup_logging()
+
+    logging.info('--- daemon started ---------------------')
+    config, error_reporter = _load_config_and_error_reporter()
+
+    try:
+        daemon_cfg = config.get_property('daemon')
+    except ValueError:
+        daemon_cfg = {}
+    interval = float(daemon_cfg.get('interval_minutes', DEFAULT_DAEMON_INTERVAL_MINUTES)) * 60
+    jitter = float(daemon_cfg.get('jitter_minutes', DEFAULT_DAEMON_JITTER_MINUTES)) * 60
+
+    stop_event = threading.Event()
+    def request_stop(signal_number, frame):
+        logging.info('Received signal %s, stopping after the current check...'%(signal_number))
+        stop_event.set()
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    # The services stay alive between the checks, and with them the pooled connections and all of
+    #  their already loaded states. An account which can't be set up is only watched again after a
+    #  restart, its error is reported once.
+    watchers, _ = create_watchers(config, error_reporter)
+
+    night_window = NightWindow()
+
+    sleeping_count = 0
+    while not stop_event.is_set():
+        if night_window.is_inside() and not night_window.is_probe_due():
+            wake_up = night_window.predicted_wake_up()
+            logging.info('Dualis is expected to be sleeping until %s, waiting.'%(wake_up.strftime('%H:%M')))
+            stop_event.wait((wake_up - datetime.now()).total_seconds())
+            continue
+
+        is_sleeping, has_errors = check_all_for_changes(config, watchers, error_reporter)
+        _record_observation(night_window, is_sleeping, has_errors)
+
+        if is_sleeping:
+            # = Dualis is most likely in its nightly maintenance, so we don't need to ask that often
+            #    (and once the window is learned, we don't ask at all until its end)
+            delay = min(interval * 2 ** sleeping_count, MAX_DAEMON_SLEEPING_BACKOFF_MINUTES * 60)
+            sleeping_count += 1
+            logging.info('Dualis is sleeping, backing off.')
+        else:
+            sleeping_count = 0
+            delay = interval
+        delay = max(MIN_DAEMON_DELAY_SECONDS, delay + random.uniform(-jitter, jitter))
+
+        next_check_at = datetime.now() + timedelta(seconds=delay)
+        if night_window.is_inside(next_check_at) and not night_window.is_probe_due(next_check_at):
+            # = we would wake up inside of the window, so we can directly wait until its end
+            delay = max(MIN_DAEMON_DELAY_SECONDS, (night_window.predicted_wake_up() - datetime.now()).total_seconds())
+
+        logging.debug('Next check in %d seconds.'%(delay))
+        stop_event.wait(delay)
+
+    connection_pool.close_all()
+    logging.info('Daemon stopped.')
+
 
 # --- called at the program invocation: ---------------------
 IS_DEBUG = False
@@ -204,6 +555,16 @@ if len(sys.argv) == 2:
         run_change_schedule_watcher()
     elif sys.argv[1] == '--change-notification-mail':
         run_change_notification_mail()
+    elif sys.argv[1] == '--daemon':
+        run_daemon()
+    elif sys.argv[1] == '--status':
+        run_status()
+    elif sys.argv[1] == '--profile-startup':
+        run_profile_startup()
+elif len(sys.argv) == 3 and sys.argv[1] == '--add-account':
+    run_add_account(sys.argv[2])
+elif len(sys.argv) == 3 and sys.argv[1] == '--remove-account':
+    run_remove_account(sys.argv[2])
 elif len(sys.argv) == 1:
     # the name of the executed file always gets passed
     run_main()
@@ -236,7 +597,7 @@ else:
     print(
           'Unrecognized argument or combination of arguments passed!'
         + '\n  Possible arguments: None, `--init`, `--new-token`, `--change-schedule-watcher`, '
-        + '`--change-notification-mail`'
+        + '`--change-notification-mail`, `--daemon`, `--status`, `--profile-startup`, `--add-account <name>`, `--remove-account <name>`'
     )
     sys.exit(-1)
 
@@ -0,0 +1,122 @@
+"""
+A lightweight instrumentation of the phases of a run (requests, parsing, git, rendering and sending
+of mails, ...) with timers and counters, which are summed up over all threads of the process.
+They are reset at the start of every run and reported at its end, as a JSON summary line in the log
+and optionally as a file for the textfile-collector of the Prometheus node_exporter.
+"""
+
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from file_helper import write_atomically
+
+PROMETHEUS_PREFIX = 'dualis_watcher'
+
+_lock = threading.Lock()
+_timers = {}  # {name : [count , total seconds , maximum seconds]}
+_counters = {}  # {name : value}
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+def count(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def add_time(name: str, seconds: float):
+    with _lock:
+        timer_values = _timers.setdefault(name, [0, 0.0, 0.0])
+        timer_values[0] += 1
+        timer_values[1] += seconds
+        timer_values[2] = max(timer_values[2], seconds)
+
+@contextmanager
+def timer(name: str):
+    """
+    Measures the time spent inside of the with-block, also if it is left by an error.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+def timed(name: str):
+    """
+    Decorator, which measures the time spent in every call of the function.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorator
+
+def snapshot() -> {str : any}:
+    """
+    @return: The current values, times in milliseconds.
+    """
+    with _lock:
+        return {
+            'timers': {
+                name : {'count': values[0], 'total_ms': round(values[1] * 1000, 1), 'max_ms': round(values[2] * 1000, 1)}
+                for name, values in sorted(_timers.items())
+            },
+            'counters': dict(sorted(_counters.items())),
+        }
+
+def summary_line(run_values: {str : any}) -> str:
+    """
+    @param run_values: Values describing the run as a whole, i.e. its duration and outcome.
+    @return: A single line of JSON with the given values and the current timers and counters.
+    """
+    summary = dict(run_values)
+    summary.update(snapshot())
+    return json.dumps(summary, sort_keys=True)
+
+def write_prometheus_textfile(path: str, run_values: {str : float}):
+    """
+    Writes the current values in the text format of Prometheus, for the textfile-collector of the
+     node_exporter. All of them are gauges, as they only describe the last run.
+    @param run_values: Numeric values describing the run as a whole, each one gets exported as
+     `dualis_watcher_last_run_<name>`.
+    """
+    lines = []
+    def add_metric(name: str, help_text: str, samples: [(str, float)]):
+        lines.append('# HELP %s_%s %s'%(PROMETHEUS_PREFIX, name, help_text))
+        lines.append('# TYPE %s_%s gauge'%(PROMETHEUS_PREFIX, name))
+        for labels, value in samples:
+            lines.append('%s_%s%s %s'%(PROMETHEUS_PREFIX, name, labels, repr(float(value))))
+
+    with _lock:
+        timers = sorted(_timers.items())
+        counters = sorted(_counters.items())
+
+    for name, value in sorted(run_values.items()):
+        add_metric('last_run_%s'%(name), 'Describes the last run: %s.'%(name.replace('_', ' ')), [('', value)])
+    add_metric(
+        'phase_seconds', 'Time spent in the phase during the last run, summed up over all threads.',
+        [('{phase="%s"}'%(name), values[1]) for name, values in timers]
+    )
+    add_metric(
+        'phase_max_seconds', 'Longest single call of the phase during the last run.',
+        [('{phase="%s"}'%(name), values[2]) for name, values in timers]
+    )
+    add_metric(
+        'phase_calls', 'Number of calls of the phase during the last run.',
+        [('{phase="%s"}'%(name), values[0]) for name, values in timers]
+    )
+    add_metric(
+        'events', 'Number of events during the last run.',
+        [('{event="%s"}'%(name), value) for name, value in counters]
+    )
+
+    # the node_exporter may read the file at any time, so it must never see a half written one
+    write_atomically(path, '\n'.join(lines) + '\n')
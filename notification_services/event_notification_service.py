@@ -0,0 +1,79 @@
+from abc import abstractmethod
+from datetime import datetime
+
+from notification_services.notification_service import NotificationService
+from outbox import get_outbox
+from version_recorder import CollectionOfChanges
+
+
+class EventNotificationService(NotificationService):
+    """
+    Base for the Notification-Services which don't send formatted messages, but structured events
+     (i.e. as JSON) to other programs.
+    The events are queued in the outbox and delivered by deliver_pending(), all pending events for
+     the same recipient at once.
+    """
+    name = None
+    # the prefix of the recipients in the outbox, to keep them apart from the ones of other services
+
+    @abstractmethod
+    def get_recipient(self) -> str:
+        """
+        @return: Where the events are delivered to, None if the service is not configured.
+        """
+        pass
+
+    @abstractmethod
+    def _deliver_events(self, recipient: str, events: [{str : any}]) -> None:
+        """
+        Delivers the given events, raises an error if that failed.
+        """
+        pass
+
+    def is_configured(self) -> bool:
+        return self.get_recipient() is not None
+
+    def notify_about_changes_in_results(self, changes: CollectionOfChanges, course_names: {str : str}) -> None:
+        # the results_handler pulls in BeautifulSoup, which is only needed to describe the changes
+        from dualis_connector.results_handler import deserialize_result
+
+        self._enqueue_event('results', {
+            'count': changes.diff_count,
+            'added': [course_names[course_id] for course_id in changes.added],
+            'deleted': [deserialize_result(content)[0] for content in changes.deleted.values()],
+            'modified': { course_names[course_id] : fragments for course_id, fragments in changes.modified.items() },
+        })
+
+    def notify_about_changes_in_schedule(self, changes: [str], uid: str):
+        self._enqueue_event('schedule', {
+            'count': len(changes) - 1,
+            'uid': uid,
+            'fragments': changes,
+        })
+
+    def notify_about_error(self, error_description: str) -> None:
+        self._enqueue_event('error', {'description': error_description})
+
+    def deliver_pending(self) -> bool:
+        recipient = self.get_recipient()
+        if recipient is None:
+            return True
+
+        return get_outbox().deliver(
+            lambda prefixed_recipient, events, failed_count: self._deliver_events(recipient, events),
+            '%s:%s'%(self.name, recipient)
+        )
+
+    def _enqueue_event(self, event_type: str, data: {str : any}):
+        recipient = self.get_recipient()
+        if recipient is None:
+            return
+
+        event = {
+            'type': event_type,
+            'created_at': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+            'account': self.config_helper.get_account_name(),
+            #          ^ the webhook and the file are usually shared by all accounts
+        }
+        event.update(data)
+        get_outbox().enqueue('%s:%s'%(self.name, recipient), event)
@@ -0,0 +1,43 @@
+import json
+import logging
+import os
+import threading
+
+from notification_services.event_notification_service import EventNotificationService
+
+
+_write_lock = threading.Lock()  # so lines of multiple accounts don't get mixed up
+
+
+class FileSinkService(EventNotificationService):
+    """
+    Appends the notifications as JSON lines to a local file, i.e. to be processed by other programs.
+    """
+    name = 'file'
+
+    def interactively_configure(self) -> None:
+        do_file_input = input('Do you want to write Notifications into a local file [y/n]?   ')
+        while not (do_file_input == 'y' or do_file_input == 'n'):
+            do_file_input = input('Unrecognized input. Try again:   ')
+
+        if do_file_input == 'n':
+            self.config_helper.remove_property('file_sink')
+            return
+
+        path = input('Path of the file [notifications.jsonl]:   ') or 'notifications.jsonl'
+        self.config_helper.set_property('file_sink', {'path': path})
+
+    def get_recipient(self) -> str:
+        try:
+            return self.config_helper.get_property('file_sink').get('path', 'notifications.jsonl')
+        except ValueError:
+            return None
+
+    def _deliver_events(self, path: str, events: [{str : any}]) -> None:
+        logging.debug('Writing %s events into %s...'%(len(events), path))
+        lines = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+        with _write_lock:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
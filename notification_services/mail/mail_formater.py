@@ -1,15 +1,11 @@
 # coding=utf-8
 
-from email.utils import make_msgid
 from string import Template
+import html
 import re
 
-from bs4 import BeautifulSoup
-from pygments import highlight
-from pygments.formatters.html import HtmlFormatter
-from pygments.lexers.html import HtmlLexer
-
-from dualis_connector.results_handler import extract_course_name_from_result_page
+import metrics
+from dualis_connector.results_handler import deserialize_result
 from version_recorder import CollectionOfChanges
 
 """
@@ -38,9 +34,11 @@ main_wrapper = Template('''
             </table>
 
             <div style="margin: 20px; margin-bottom: 0;">
+                <!-- begin of content -->
                 <p>${introduction_text}</p>
 
                 ${content}
+                <!-- end of content -->
             </div>
         </div>
     </body>
@@ -159,9 +157,79 @@ diff_schedule_modified_box = Template('''
 ''')
 
 
-def _format_code(html_code):
+MAX_FRAGMENT_LENGTH = 6000
+# how many characters of a single diff-fragment are rendered, the rest of it is summarized
+MAX_DIFF_LENGTH = 60000
+# how many characters of diff-fragments are rendered for one course or schedule, further fragments
+#  are summarized
+
+_diff_marker_pattern = re.compile(r'\[-|-\]|\{\+|\+\}')
+_closing_markers = {'[-': '-]', '{+': '+}'}
+# the markers of the removed and added parts of a word-diff, which a truncated fragment has to close
+_highlight_pattern = re.compile(r'(&lt;/?[\w:-]+|/?&gt;)|("[^"\n\[\]{}]*")')
+# the parts of the (already escaped) code which get colored: tags and quoted strings
+
+_pygments = None  # = the lazily created (lexer, formatter)-tuple, if pygments is used
+
+
+def _highlight_builtin(code):
+    # a minimal highlighter for the small subset of HTML and diff-markers we use, which costs next to
+    #  nothing compared to pygments and colors the text as a whole instead of token by token
+    def color(match):
+        if match.group(1):
+            return '<span style="color: #f92672">%s</span>'%(match.group(1))
+        return '<span style="color: #e6db74">%s</span>'%(match.group(2))
+
+    code_highlighted = _highlight_pattern.sub(color, html.escape(code, quote=False))
+    return '<pre style="margin: 0; color: #f8f8f2; background: #272822; line-height: 125%%;">%s</pre>'%(
+        code_highlighted
+    )
+
+def _highlight_pygments(code):
+    # pygments is only needed if it was selected for the mails, so we don't import it before
+    global _pygments
+    if _pygments is None:
+        from pygments.formatters.html import HtmlFormatter
+        from pygments.lexers.html import HtmlLexer
+        _pygments = (HtmlLexer(), HtmlFormatter(style='monokai', noclasses=True))
+
+    from pygments import highlight
+    return highlight(code, _pygments[0], _pygments[1])
+
+def _truncate(code, max_length):
+    if len(code) <= max_length:
+        return code
+
+    kept = code[:max_length]
+    kept = kept[:kept.rfind('\n') + 1] or kept  # = only whole lines are kept, if possible
+    skipped_lines = len(code[len(kept):].splitlines())
+
+    # a diff-marker may span multiple lines, or the cut had to be inside of a single long line
+    open_markers = []
+    for marker in _diff_marker_pattern.findall(kept):
+        if marker in _closing_markers:
+            open_markers.append(_closing_markers[marker])
+        elif len(open_markers) > 0 and open_markers[-1] == marker:
+            open_markers.pop()
+    if len(open_markers) > 0:
+        kept = kept.rstrip('\n') + ''.join(reversed(open_markers)) + '\n'
+    elif not kept.endswith('\n'):
+        kept += '\n'
+
+    return kept + '[... %s weitere Zeilen ausgelassen ...]\n'%(skipped_lines)
+
+def _format_code(code, highlighter='builtin', max_length=MAX_FRAGMENT_LENGTH):
+    """
+    @param highlighter: `builtin` for the fast built-in highlighter or `pygments`.
+    @param max_length: How many characters of the code are rendered, the rest of it is summarized.
+    """
+    code = _truncate(code, max_length)
+
     # syntax highlighting:
-    code_highlighted = highlight(html_code, HtmlLexer(), HtmlFormatter(style='monokai', noclasses=True))
+    if highlighter == 'pygments':
+        code_highlighted = _highlight_pygments(code)
+    else:
+        code_highlighted = _highlight_builtin(code)
     # add formatting for diff-markers:
     common_diff_style = ' margin-right: 3px; padding-right: 7px; padding-left: 7px;'
     code_formatted = code_highlighted \
@@ -176,15 +244,37 @@ def _format_code(html_code):
 
     return code_wrapped
 
-def _finish_with_main_wrapper(content: str, introduction: str) -> (str, {str : str}):
-    # cids link the attatched media-files to be displayed inline
-    header_cid = make_msgid()
-    extender_cid = make_msgid()
+def _format_fragments(fragments, highlighter='builtin', post_processing=lambda code: code):
+    """
+    Formats the given diff-fragments until the budget of the mail is used up, the remaining ones are
+     only counted.
+    """
+    formatted = ''
+    remaining_length = MAX_DIFF_LENGTH
+    for index, fragment in enumerate(fragments):
+        if remaining_length <= 0:
+            formatted += '<p style="color: #7d878d;">[... %s weitere Abschnitte ausgelassen ...]</p>'%(
+                len(fragments) - index
+            )
+            break
+        max_length = min(remaining_length, MAX_FRAGMENT_LENGTH)
+        formatted += post_processing(_format_code(fragment, highlighter, max_length))
+        remaining_length -= min(len(fragment), max_length)
+
+    return formatted
+
+# cids link the attatched media-files to be displayed inline. They only have to be unique inside of
+#  a mail, so they are the same for all mails, which lets the images and the skeleton of the main
+#  wrapper be prepared only once.
+header_cid = '<header.png@dualis-watcher>'
+extender_cid = '<header_extender.png@dualis-watcher>'
+
+main_wrapper_skeleton = Template(main_wrapper.safe_substitute(
+    header_cid=header_cid[1:-1], extender_cid=extender_cid[1:-1]
+))
 
-    full_content = main_wrapper.substitute(
-        content=content, introduction_text=introduction,
-        header_cid=header_cid[1:-1], extender_cid=extender_cid[1:-1]
-    )
+def _finish_with_main_wrapper(content: str, introduction: str) -> (str, {str : str}):
+    full_content = main_wrapper_skeleton.substitute(content=content, introduction_text=introduction)
 
     cids_and_filenames = {}
     cids_and_filenames.update({header_cid : 'header.png'})
@@ -196,7 +286,9 @@ def _finish_with_main_wrapper(content: str, introduction: str) -> (str, {str : s
 def _redact_grades(content):
     return re.sub(r'\d{1,3},\d{1,2}', '<span style="color:#a49aad; font-style:italic; font-weight:bold;">Note</span>', content)
 
-def create_full_dualis_diff_mail(changes: CollectionOfChanges, course_names: {str, str}) -> (str, {str : str}):
+@metrics.timed('mail.render')
+def create_full_dualis_diff_mail(changes: CollectionOfChanges, course_names: {str, str},
+                                 highlighter: str = 'builtin') -> (str, {str : str}):
     inner_diff_content = ''
 
     for added_element_id in changes.added:
@@ -205,19 +297,14 @@ def create_full_dualis_diff_mail(changes: CollectionOfChanges, course_names: {st
         )
 
     for deleted_element_id in changes.deleted:
-        deleted_name = extract_course_name_from_result_page(
-            BeautifulSoup(changes.deleted[deleted_element_id], 'html.parser')
-        )
+        deleted_name = deserialize_result(changes.deleted[deleted_element_id])[0]
 
         inner_diff_content += diff_dualis_deleted_box.substitute(
             course_id=deleted_element_id, course_name=deleted_name
         )
 
     for modified_element_id in changes.modified:
-        inner_diffs = ''
-        inner_diffs_fragments = changes.modified[modified_element_id]
-        for fragment in inner_diffs_fragments:
-            inner_diffs += _format_code(fragment)
+        inner_diffs = _format_fragments(changes.modified[modified_element_id], highlighter)
 
         inner_diff_content += diff_dualis_modified_box.substitute(
             course_id=modified_element_id, course_name=course_names[modified_element_id],
@@ -259,12 +346,11 @@ def _format_special_ical(code):
 
     return code
 
-def create_full_schedule_diff_mail(changes: [str], uid: str) -> (str, {str : str}):
+@metrics.timed('mail.render')
+def create_full_schedule_diff_mail(changes: [str], uid: str, highlighter: str = 'builtin') -> (str, {str : str}):
     content = ''
 
-    inner_diffs = ''
-    for fragment in changes:
-        inner_diffs += _format_special_ical(_format_code(fragment))
+    inner_diffs = _format_fragments(changes, highlighter, _format_special_ical)
 
     content += diff_schedule_modified_box.substitute(
         code_content=inner_diffs, uid=uid
@@ -278,6 +364,23 @@ def create_full_schedule_diff_mail(changes: [str], uid: str) -> (str, {str : str
 
     return full_content
 
+@metrics.timed('mail.render')
+def create_full_combined_mail(full_contents: [str], introduction: str) -> (str, {str : str}):
+    """
+    Combines multiple mails into a single one, one below the other.
+    @param full_contents: The contents of the mails, as created by the other functions.
+    """
+    inner_contents = [
+        full_content.split('<!-- begin of content -->', 1)[1].split('<!-- end of content -->', 1)[0]
+        for full_content in full_contents
+    ]
+    separator = '<hr style="border: 0; border-top: 1px solid #dfdede; margin-top: 20px; margin-bottom: 20px;"/>'
+
+    return _finish_with_main_wrapper(
+        separator.join(inner_contents), introduction
+    )
+
+@metrics.timed('mail.render')
 def create_full_welcome_mail() -> (str, {str : str}):
     content = info_message_box.substitute(text='Hurra, es funktioniert \\o/')
 
@@ -285,6 +388,7 @@ def create_full_welcome_mail() -> (str, {str : str}):
 
     return full_content
 
+@metrics.timed('mail.render')
 def create_full_error_mail(details) -> (str, {str : str}):
     content = error_message_box.substitute(details=details)
 
@@ -1,11 +1,8 @@
 import logging
-import traceback
 from getpass import getpass
 
-from notification_services.mail.mail_formater import create_full_welcome_mail, create_full_dualis_diff_mail, \
-    create_full_error_mail, create_full_schedule_diff_mail
-from notification_services.mail.mail_shooter import MailShooter
 from notification_services.notification_service import NotificationService
+from outbox import get_outbox
 from version_recorder import CollectionOfChanges
 
 
@@ -18,6 +15,9 @@ class MailService(NotificationService):
         if do_mail_input == 'n':
             self.config_helper.remove_property('mail')
         else:
+            from notification_services.mail.mail_formater import create_full_welcome_mail
+            from notification_services.mail.mail_shooter import MailShooter
+
             print('[The following Inputs are not validated!]')
 
             config_valid = False
@@ -36,6 +36,7 @@ class MailService(NotificationService):
                 )
                 try:
                     mail_shooter.send(target, 'Hey!', welcome_content[0], welcome_content[1])
+                    mail_shooter.close()
                 except BaseException as e:
                     print('Error while sending the test mail: %s'%(str(e)))
                 else:
@@ -63,40 +64,94 @@ class MailService(NotificationService):
 
                 self.config_helper.set_property('mail', mail_cfg)
 
+    def is_configured(self) -> bool:
+        try:
+            self.config_helper.get_property('mail')
+            return True
+        except ValueError:
+            return False
+
+    # The mail formater and shooter pull in a lot of heavy dependencies (like pygments and smtplib),
+    #  so they are only imported once a mail is actually sent.
+
     def _send_mail(self, subject, mail_content: (str, {str : str})):
+        """
+        Queues the mail in the outbox, from which it is sent by deliver_pending().
+        """
         try:
             mail_cfg = self.config_helper.get_property('mail')
         except ValueError:
             logging.debug('Mail-Notifications not configured, skipping.')
-            pass  # ignore exception further up
+            return
+
+        get_outbox().enqueue(
+            mail_cfg['target'], {'subject': subject, 'content': mail_content[0], 'cids': mail_content[1]}
+        )
 
+    def deliver_pending(self) -> bool:
         try:
-            logging.debug('Sending Notification via Mail...')
-
-            mail_shooter = MailShooter(
-                mail_cfg['sender'], mail_cfg['server_host'], int(mail_cfg['server_port']),
-                mail_cfg['username'], mail_cfg['password']
-            )
-            mail_shooter.send(
-                mail_cfg['target'],
-                subject, mail_content[0], mail_content[1]
-            )
-        except BaseException as e:
-            error_formatted = traceback.format_exc()
-            logging.error('While sending notification:\n%s' % (error_formatted), extra={'exception': e})
-            raise e  # to be properly notified via Sentry
+            mail_cfg = self.config_helper.get_property('mail')
+        except ValueError:
+            return True
+
+        return get_outbox().deliver(self._deliver_mails, mail_cfg['target'])
+
+    def _deliver_mails(self, target: str, mails: [{str : any}], failed_count: int):
+        from notification_services.mail.mail_shooter import get_shooter
+
+        if len(mails) == 1:
+            subject = mails[0]['subject']
+            mail_content = (mails[0]['content'], mails[0]['cids'])
+        else:
+            # = multiple notifications are pending (i.e. for the results and the schedule, or ones
+            #    which couldn't be delivered before), they are all sent together
+            from notification_services.mail.mail_formater import create_full_combined_mail
+            if failed_count == 0:
+                introduction = 'Es gibt %s neue Benachrichtigungen:'%(len(mails))
+            elif failed_count == len(mails):
+                introduction = 'Die folgenden %s Benachrichtigungen konnten bisher nicht zugestellt werden:'%(len(mails))
+            else:
+                introduction = 'Es gibt %s Benachrichtigungen, %s davon konnten bisher nicht zugestellt werden:'%(
+                    len(mails), failed_count
+                )
+            subject = '%s Benachrichtigungen (%s)'%(len(mails), '; '.join(mail['subject'] for mail in mails))
+            mail_content = create_full_combined_mail([mail['content'] for mail in mails], introduction)
+
+        logging.debug('Sending Notification via Mail...')
+        mail_cfg = self.config_helper.get_property('mail')
+        # all notifications of the process share the SMTP-session of the same server and account
+        mail_shooter = get_shooter(
+            mail_cfg['sender'], mail_cfg['server_host'], int(mail_cfg['server_port']),
+            mail_cfg['username'], mail_cfg['password']
+        )
+        mail_shooter.send(target, subject, mail_content[0], mail_content[1])
+
+    def _get_highlighter(self) -> str:
+        """
+        @return: How the diffs in the mails are highlighted, `builtin` (the default) or `pygments`.
+        """
+        try:
+            return self.config_helper.get_property('mail').get('highlighter', 'builtin')
+        except ValueError:
+            return 'builtin'
 
     def notify_about_changes_in_results(self, changes: CollectionOfChanges, course_names: {str: str}) -> None:
-        mail_content = create_full_dualis_diff_mail(changes, course_names)
+        from notification_services.mail.mail_formater import create_full_dualis_diff_mail
+        mail_content = create_full_dualis_diff_mail(changes, course_names, self._get_highlighter())
         self._send_mail('%s neue Änderungen in den Modul-Ergebnissen!'%(changes.diff_count), mail_content)
 
     def notify_about_changes_in_schedule(self, changes: [str], uid: str):
-        mail_content = create_full_schedule_diff_mail(changes, uid)
+        from notification_services.mail.mail_formater import create_full_schedule_diff_mail
+        mail_content = create_full_schedule_diff_mail(changes, uid, self._get_highlighter())
         self._send_mail('%s neue Änderungen im Vorlesungsplan!' % (len(changes) - 1), mail_content)
 
     def notify_about_error(self, error_description: str):
-        if not self.config_helper.get_property('mail').get('send_error_msg', True):
-            return
+        try:
+            if not self.config_helper.get_property('mail').get('send_error_msg', True):
+                return
+        except ValueError:
+            return  # = no mail notifications configured at all
 
+        from notification_services.mail.mail_formater import create_full_error_mail
         mail_content = create_full_error_mail(error_description)
         self._send_mail('Fehler!', mail_content)
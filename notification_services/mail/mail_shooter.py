@@ -1,11 +1,68 @@
+import atexit
 import os
 import smtplib
-from email.message import EmailMessage
+import threading
+from email.message import EmailMessage, MIMEPart
+
+import metrics
+
+
+_shooters = {}
+_shooters_lock = threading.Lock()
+
+_inline_images = {}  # {(path, cid) : (modification time, MIME-part)}
+_inline_images_lock = threading.Lock()
+
+
+def get_shooter(sender: str, smtp_server_host: str, smtp_server_port: int, username: str, password: str) \
+        -> 'MailShooter':
+    """
+    @return: The MailShooter for the given configuration, which is shared by the whole process, so
+     all notifications are sent over the same SMTP-session.
+    """
+    key = (sender, smtp_server_host, smtp_server_port, username, password)
+    with _shooters_lock:
+        if key not in _shooters:
+            _shooters[key] = MailShooter(*key)
+        return _shooters[key]
+
+
+def close_all():
+    with _shooters_lock:
+        shooters = list(_shooters.values())
+    for shooter in shooters:
+        shooter.close()
+
+atexit.register(close_all)
+
+
+def _get_inline_png(path: str, cid: str) -> MIMEPart:
+    """
+    @return: The already encoded MIME-part of the image, which is only read and encoded again if the
+     file changed. The part is shared by all mails, so it must not be modified.
+    """
+    modification_time = os.stat(path).st_mtime_ns
+    with _inline_images_lock:
+        cached = _inline_images.get((path, cid))
+        if cached is not None and cached[0] == modification_time:
+            return cached[1]
+
+    with open(path, 'rb') as png_file:
+        file_contents = png_file.read()
+    part = MIMEPart()
+    part.set_content(file_contents, 'image', 'png', disposition='inline', cid=cid)
+
+    with _inline_images_lock:
+        _inline_images[(path, cid)] = (modification_time, part)
+    return part
 
 
 class MailShooter:
     """
     Encapsulates the sending of notifcation-mails.
+
+    The SMTP-session is opened with the first mail and kept open for all following ones, until
+    close() is called. If the server closed it in the meantime, a new one is opened transparently.
     """
     def __init__(self, sender: str, smtp_server_host: str, smtp_server_port: int, username: str, password: str):
         self.sender = sender
@@ -14,7 +71,33 @@ class MailShooter:
         self.username = username
         self.password = password
 
+        self._smtp_connection = None
+        self._lock = threading.Lock()  # a session can only send one mail at a time
+
     def send(self, target: str, subject: str, html_content_with_cids: str, inline_png_cids_filenames: {str : str}):
+        error = self.send_all([self.create_message(target, subject, html_content_with_cids, inline_png_cids_filenames)])[0]
+        if error is not None:
+            raise error
+
+    def send_all(self, messages: [EmailMessage]) -> [BaseException]:
+        """
+        Sends the given messages one after the other over the same session.
+        @return: For every message, None if it was sent or the error which prevented it.
+        """
+        results = []
+        with self._lock:
+            for msg in messages:
+                try:
+                    self._send_message(msg)
+                except BaseException as e:
+                    results.append(e)
+                else:
+                    results.append(None)
+
+        return results
+
+    def create_message(self, target: str, subject: str, html_content_with_cids: str,
+                       inline_png_cids_filenames: {str : str}) -> EmailMessage:
         msg = EmailMessage()
         msg['Subject'] = subject
         msg['From'] = self.sender
@@ -26,15 +109,51 @@ class MailShooter:
             html_content_with_cids, subtype='html'
         )
 
+        html_part = msg.get_payload()[1]
         for png_cid in inline_png_cids_filenames:
             full_path_to_png = os.path.abspath(os.path.join(
                 os.path.dirname(__file__), inline_png_cids_filenames[png_cid]
             ))
-            with open(full_path_to_png, 'rb') as png_file:
-                file_contents = png_file.read()
-                msg.get_payload()[1].add_related(file_contents, 'image', 'png', cid=png_cid)
+            if html_part.get_content_type() != 'multipart/related':
+                html_part.make_related()
+            html_part.attach(_get_inline_png(full_path_to_png, png_cid))
+
+        return msg
+
+    def close(self):
+        with self._lock:
+            if self._smtp_connection is None:
+                return
+            try:
+                self._smtp_connection.quit()
+            except (smtplib.SMTPException, OSError):
+                self._smtp_connection.close()  # = the server closed the session already
+            self._smtp_connection = None
+
+    @metrics.timed('mail.send')
+    def _send_message(self, msg: EmailMessage):
+        is_reused = self._smtp_connection is not None
+        if not is_reused:
+            self._connect()
+
+        try:
+            self._smtp_connection.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # = the server closed the session since the last mail (i.e. after a timeout)
+            self._smtp_connection = None
+            if not is_reused:
+                raise
+            self._connect()
+            self._smtp_connection.send_message(msg)
+        metrics.count('mail.sent')
 
-        with smtplib.SMTP(self.smtp_server_host, self.smtp_server_port) as smtp_connection:
+    @metrics.timed('mail.connect')
+    def _connect(self):
+        smtp_connection = smtplib.SMTP(self.smtp_server_host, self.smtp_server_port)
+        try:
             smtp_connection.starttls()
             smtp_connection.login(self.username, self.password)
-            smtp_connection.send_message(msg)
+        except BaseException:
+            smtp_connection.close()
+            raise
+        self._smtp_connection = smtp_connection
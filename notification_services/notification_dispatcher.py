@@ -0,0 +1,96 @@
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from config_helper import ConfigHelper
+from notification_services.file_sink.file_sink_service import FileSinkService
+from notification_services.mail.mail_service import MailService
+from notification_services.notification_service import NotificationService
+from notification_services.webhook.webhook_service import WebhookService
+from version_recorder import CollectionOfChanges
+
+
+BACKENDS = {
+    'mail': MailService,
+    'webhook': WebhookService,
+    'file': FileSinkService,
+}
+# the available Notification-Services, selected by their name in the `notifiers` config property
+
+DEFAULT_BACKENDS = ['mail']
+
+
+def register_backend(name: str, service_class: type):
+    BACKENDS[name] = service_class
+
+
+class NotificationDispatcher(NotificationService):
+    """
+    Passes every notification on to all configured Notification-Services. The pending notifications
+    of all of them are delivered in parallel.
+    """
+    def __init__(self, config_helper: ConfigHelper):
+        super().__init__(config_helper)
+
+        try:
+            names = self.config_helper.get_property('notifiers')
+        except ValueError:
+            names = DEFAULT_BACKENDS
+
+        unknown_names = [name for name in names if name not in BACKENDS]
+        if len(unknown_names) > 0:
+            raise ValueError('Unknown notifiers configured: %s'%(', '.join(unknown_names)))
+
+        self.services = [BACKENDS[name](config_helper) for name in names]
+
+    def interactively_configure(self) -> None:
+        """
+        Walks the User through the configuration of every available Notification-Service, the
+         activated ones are selected as notifiers.
+        """
+        services = { name : service_class(self.config_helper) for name, service_class in BACKENDS.items() }
+        for service in services.values():
+            service.interactively_configure()
+
+        names = [name for name, service in services.items() if service.is_configured()]
+        self.config_helper.set_property('notifiers', names)
+        self.services = [services[name] for name in names]
+
+    def notify_about_changes_in_results(self, changes: CollectionOfChanges, course_names: {str : str}) -> None:
+        self._for_all(lambda service: service.notify_about_changes_in_results(changes, course_names))
+
+    def notify_about_changes_in_schedule(self, changes: [str], uid: str):
+        self._for_all(lambda service: service.notify_about_changes_in_schedule(changes, uid))
+
+    def notify_about_error(self, error_description: str) -> None:
+        self._for_all(lambda service: service.notify_about_error(error_description))
+
+    def deliver_pending(self) -> bool:
+        if len(self.services) == 0:
+            return True
+        elif len(self.services) == 1:
+            return self.services[0].deliver_pending()
+
+        with ThreadPoolExecutor(max_workers=len(self.services)) as executor:
+            futures = [executor.submit(service.deliver_pending) for service in self.services]
+
+        # like in _for_all, an error of one service (i.e. about dropped notifications) is only
+        #  raised once all of them are done
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+        return all(future.result() for future in futures)
+
+    def _for_all(self, action):
+        # One failing service must not keep the others from getting the notification. The first
+        #  error is raised afterwards, so it is still reported.
+        first_error = None
+        for service in self.services:
+            try:
+                action(service)
+            except BaseException as e:
+                logging.error('Error in %s:\n%s'%(type(service).__name__, traceback.format_exc()))
+                first_error = first_error or e
+
+        if first_error is not None:
+            raise first_error
@@ -48,3 +48,17 @@ class NotificationService:
         @param error_description: The error text.
         """
         pass
+
+    def is_configured(self) -> bool:
+        """
+        @return: If the Notification-Service is configured, so it can send out Notifications.
+        """
+        return True
+
+    def deliver_pending(self) -> bool:
+        """
+        Delivers the Notifications which were queued instead of being sent out directly, including
+         the ones which couldn't be delivered before and are due to be tried again.
+        @return: If all due Notifications were delivered.
+        """
+        return True
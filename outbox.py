@@ -0,0 +1,202 @@
+import json
+import logging
+import threading
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from file_helper import locked, write_atomically
+
+
+FIRST_RETRY_DELAY_MINUTES = 1
+MAX_RETRY_DELAY_MINUTES = 6 * 60
+# the delay before the next try doubles with every failed one, up to this
+MAX_AGE_DAYS = 7
+# notifications which couldn't be delivered for this long are dropped
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+
+
+def get_outbox(file_name: str = 'outbox.json') -> 'Outbox':
+    """
+    @return: The Outbox stored in the given file, which is shared by the whole process.
+    """
+    with _outboxes_lock:
+        if file_name not in _outboxes:
+            _outboxes[file_name] = Outbox(file_name)
+        return _outboxes[file_name]
+
+
+class Outbox:
+    """
+    Keeps the notifications which weren't delivered yet on disk, so they survive failed runs, and
+    retries them with an exponential backoff.
+
+    All pending notifications for the same recipient are delivered together, so the recipient gets
+    a single message for them.
+
+    The file may be shared with other processes (i.e. a manual run next to the daemon), so it is
+    read again before every change and only written under a lock.
+    """
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._recipients_in_delivery = set()
+        self._entries = self._load()
+
+    def enqueue(self, recipient: str, payload: {str : any}):
+        """
+        @param payload: Everything needed to deliver the notification, it has to be serializable
+         as JSON.
+        """
+        now = datetime.now()
+        entry = {
+            'id': uuid.uuid4().hex,
+            'recipient': recipient,
+            'payload': payload,
+            'attempts': 0,
+            'created_at': now.strftime(TIME_FORMAT),
+            'next_attempt_at': now.strftime(TIME_FORMAT),
+        }
+        with self._lock:
+            self._change(lambda: self._entries.append(entry))
+
+    def pending_count(self, recipient: str = None) -> int:
+        with self._lock:
+            return len([entry for entry in self._entries if recipient is None or entry['recipient'] == recipient])
+
+    def deliver(self, send, recipient: str = None, now: datetime = None) -> bool:
+        """
+        Delivers all pending notifications which are due, grouped by their recipient.
+        The outbox stays usable by other threads while the notifications are sent.
+        @param send: Function which gets a recipient, the payloads of all of its pending
+         notifications and how many of them failed to be delivered before, and delivers them (as one
+         message). It raises an error if that failed.
+        @param recipient: Only deliver the notifications for this recipient.
+        @return: If all due notifications were delivered.
+        @raise UndeliverableError: After the delivery, if notifications were dropped because they
+         couldn't be delivered for too long.
+        """
+        now = now or datetime.now()
+        with self._lock:
+            expired_count = self._change(lambda: self._drop_expired(now, recipient))
+            #                 ^ also takes over the notifications which other processes queued
+
+            groups = {}
+            for entry in self._entries:
+                if recipient is not None and entry['recipient'] != recipient:
+                    continue
+                if entry['recipient'] in self._recipients_in_delivery:
+                    continue  # = another thread is delivering them right now
+                groups.setdefault(entry['recipient'], []).append(entry)
+
+            groups = {
+                current_recipient : group for current_recipient, group in groups.items()
+                if self._is_due(group, now)
+            }
+            self._recipients_in_delivery.update(groups.keys())
+
+        is_everything_delivered = True
+        for current_recipient, group in groups.items():
+            try:
+                send(
+                    current_recipient, [entry['payload'] for entry in group],
+                    len([entry for entry in group if entry['attempts'] > 0])
+                )
+            except BaseException:
+                logging.error(
+                    'Error while delivering %s notifications to %s, trying again later:\n%s'%(
+                        len(group), current_recipient, traceback.format_exc()
+                    )
+                )
+                is_everything_delivered = False
+                is_delivered = False
+            else:
+                is_delivered = True
+
+            with self._lock:
+                self._change(lambda: self._record_delivery(group, is_delivered, now))
+                self._recipients_in_delivery.discard(current_recipient)
+
+        if expired_count > 0:
+            # = the retries gave up, which has to reach the error reporting, not only the log
+            raise UndeliverableError(
+                '%s notifications could not be delivered for %s days and were dropped.'%(expired_count, MAX_AGE_DAYS)
+            )
+
+        return is_everything_delivered
+
+    @staticmethod
+    def _is_due(group: [{str : any}], now: datetime) -> bool:
+        """
+        @return: If the next try to deliver the given notifications of one recipient is due.
+        """
+        failed_entries = [entry for entry in group if entry['attempts'] > 0]
+        if len(failed_entries) > 0:
+            # New notifications wait along with the ones which failed before, as they are delivered
+            #  together. Otherwise every new one would undo the backoff.
+            oldest_failed_entry = min(failed_entries, key=lambda entry: entry['created_at'])
+            return datetime.strptime(oldest_failed_entry['next_attempt_at'], TIME_FORMAT) <= now
+        return min(datetime.strptime(entry['next_attempt_at'], TIME_FORMAT) for entry in group) <= now
+
+    def _record_delivery(self, group: [{str : any}], is_delivered: bool, now: datetime):
+        group_ids = set(entry['id'] for entry in group)
+        if is_delivered:
+            self._entries = [entry for entry in self._entries if entry['id'] not in group_ids]
+            return
+
+        attempts = max(entry['attempts'] for entry in group) + 1
+        delay = min(FIRST_RETRY_DELAY_MINUTES * 2 ** (attempts - 1), MAX_RETRY_DELAY_MINUTES)
+        for entry in self._entries:
+            if entry['id'] in group_ids:
+                entry['attempts'] = attempts
+                entry['next_attempt_at'] = (now + timedelta(minutes=delay)).strftime(TIME_FORMAT)
+
+    def _drop_expired(self, now: datetime, recipient: str = None) -> int:
+        """
+        @return: How many notifications were dropped.
+        """
+        expired = [
+            entry for entry in self._entries
+            if (recipient is None or entry['recipient'] == recipient)
+            and datetime.strptime(entry['created_at'], TIME_FORMAT) < now - timedelta(days=MAX_AGE_DAYS)
+        ]
+        if len(expired) == 0:
+            return 0
+
+        logging.error(
+            'Dropping %s notifications to %s which could not be delivered for %s days.'%(
+                len(expired), ', '.join(sorted(set(entry['recipient'] for entry in expired))), MAX_AGE_DAYS
+            )
+        )
+        expired_ids = set(entry['id'] for entry in expired)
+        self._entries = [entry for entry in self._entries if entry['id'] not in expired_ids]
+        return len(expired)
+
+    def _change(self, change) -> any:
+        """
+        Applies the given change to the entries and saves them. Other processes may have changed the
+         file in the meantime, so the entries are read from it again before, and no other process
+         can change it until the result is written. Has to be called under the lock.
+        @return: What the change returned.
+        """
+        with locked(self.file_name + '.lock'):
+            self._entries = self._load()
+            result = change()
+            write_atomically(self.file_name, json.dumps(self._entries))
+        return result
+
+    def _load(self) -> [{str : any}]:
+        try:
+            with open(self.file_name, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return []
+
+
+class UndeliverableError(Exception):
+    """An Exception which gets thrown if notifications had to be dropped, as they couldn't be delivered"""
+    pass
@@ -0,0 +1,75 @@
+"""
+Measures how long the imports of the program take at its start-up, as this is a considerable part of
+every (cron-triggered) run.
+"""
+
+import ast
+import os
+import subprocess
+import sys
+
+DEFAULT_TOP_COUNT = 15
+
+
+def get_startup_imports(main_file_path: str) -> [str]:
+    """
+    @return: The names of all modules which get imported at the top level of the given file.
+    """
+    with open(main_file_path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    module_names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            module_names += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            module_names.append(node.module)
+
+    return module_names
+
+def measure_imports(main_file_path: str) -> [(str, int, int)]:
+    """
+    Imports the start-up modules of the given file in a fresh interpreter.
+    @return: List of (module name , time for the module itself , time including all its imports),
+     times in microseconds, in the order of the imports.
+    """
+    import_statement = 'import ' + ', '.join(get_startup_imports(main_file_path))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', import_statement],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=os.path.dirname(main_file_path)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'backslashreplace'))
+
+    entries = []
+    for line in result.stderr.decode('utf-8', 'backslashreplace').splitlines():
+        # a line looks like i.e. 'import time:       346 |      60627 |   dualis_connector.request_helper'
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, module_name = line[len('import time:'):].split('|')
+        entries.append((module_name.strip(), int(self_time), int(cumulative_time)))
+
+    return entries
+
+def print_profile(main_file_path: str, budget_ms: float = None, top_count: int = DEFAULT_TOP_COUNT) -> bool:
+    """
+    Prints the modules with the most expensive imports and the total import time.
+    @return: False if the total import time exceeds the given budget.
+    """
+    entries = measure_imports(main_file_path)
+    total_ms = sum(entry[1] for entry in entries) / 1000
+
+    print('Slowest imports (cumulative, including their own imports):')
+    for module_name, _, cumulative_time in sorted(entries, key=lambda entry: -entry[2])[:top_count]:
+        print('  %8.1f ms   %s'%(cumulative_time / 1000, module_name))
+
+    print('Imported modules: %s'%(len(entries)))
+    print('Total import time: %.1f ms'%(total_ms))
+
+    if budget_ms is not None:
+        if total_ms > budget_ms:
+            print('Over the budget of %s ms!'%(budget_ms))
+            return False
+        print('Within the budget of %s ms.'%(budget_ms))
+
+    return True
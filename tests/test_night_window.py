@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from dualis_connector.night_window import NightWindow
+
+
+def _at(day: int, hour: int, minute: int, second: float = 0) -> datetime:
+    return datetime(2018, 3, day, hour, minute) + timedelta(seconds=second)
+
+
+class NightWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.night_window = NightWindow(os.path.join(self.dir, 'night_window.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _learn(self, sleeping: [(int, int)], awake: [(int, int)], days: [int] = (1, 2)):
+        for day in days:
+            for hour, minute in awake:
+                self.night_window.record_awake(_at(day, hour, minute))
+            for hour, minute in sleeping:
+                self.night_window.record_sleeping(_at(day, hour, minute))
+
+    def test_edges_of_the_window(self):
+        self._learn(sleeping=[(1, 0), (2, 30), (4, 45)], awake=[(0, 30), (5, 0)])
+        # = sleeping from 01:00 to 04:45, expected to be awake from 04:50 on
+
+        self.assertFalse(self.night_window.is_inside(_at(3, 0, 59)))
+        self.assertTrue(self.night_window.is_inside(_at(3, 1, 0)))
+        self.assertTrue(self.night_window.is_inside(_at(3, 4, 49, 59.5)))
+        self.assertFalse(self.night_window.is_inside(_at(3, 4, 50)))
+        self.assertFalse(self.night_window.is_inside(_at(3, 4, 50, 0.5)))
+
+        self.assertEqual(self.night_window.predicted_wake_up(_at(3, 4, 49, 59.5)), _at(3, 4, 50))
+        self.assertEqual(self.night_window.predicted_wake_up(_at(3, 1, 0)), _at(3, 4, 50))
+
+    def test_window_across_midnight(self):
+        self._learn(sleeping=[(23, 30), (0, 15), (1, 0)], awake=[(23, 0), (1, 30)])
+        # = sleeping from 23:30 to 01:00, expected to be awake from 01:05 on
+
+        self.assertEqual(self.night_window.get_window(_at(3, 12, 0))[:2], (23 * 60 + 30, 60))
+        self.assertFalse(self.night_window.is_inside(_at(3, 23, 29)))
+        self.assertTrue(self.night_window.is_inside(_at(3, 23, 30)))
+        self.assertTrue(self.night_window.is_inside(_at(4, 0, 0)))
+        self.assertTrue(self.night_window.is_inside(_at(4, 1, 4)))
+        self.assertFalse(self.night_window.is_inside(_at(4, 1, 5)))
+
+        self.assertEqual(self.night_window.predicted_wake_up(_at(3, 23, 45)), _at(4, 1, 5))
+        self.assertEqual(self.night_window.predicted_wake_up(_at(4, 0, 30)), _at(4, 1, 5))
+
+    def test_probe_once_per_night(self):
+        self._learn(sleeping=[(23, 30), (1, 0)], awake=[(23, 0), (1, 30)])
+
+        self.assertTrue(self.night_window.is_probe_due(_at(3, 23, 40)))
+        self.night_window.record_sleeping(_at(3, 23, 40))
+        self.assertFalse(self.night_window.is_probe_due(_at(3, 23, 50)))
+        self.assertFalse(self.night_window.is_probe_due(_at(4, 0, 50)))
+        # = after midnight it is still the same night
+        self.assertTrue(self.night_window.is_probe_due(_at(4, 23, 40)))
+
+    def test_window_is_kept_up_by_the_probes(self):
+        self._learn(sleeping=[(1, 0), (4, 45)], awake=[(0, 30), (5, 0)])
+        for day in range(3, 30):
+            self.night_window.record_awake(_at(day, 0, 30))
+            self.night_window.record_sleeping(_at(day, 1, 0))
+            self.night_window.record_awake(_at(day, 5, 0))
+
+        self.assertTrue(self.night_window.is_inside(_at(30, 2, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
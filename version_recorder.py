@@ -1,6 +1,12 @@
+import json
 import os
 import subprocess
 
+import metrics
+from file_helper import write_atomically
+from word_diff import word_diff
+
+
 class CollectionOfChanges:
     def __init__(self, count: int, added: [str], deleted: {str : str}, modified: {str : [str]}):
         self.diff_count = count
@@ -9,48 +15,145 @@ class CollectionOfChanges:
         self.modified = modified
 
 
+def word_diff_fragments(old: str, new: str) -> [str]:
+    """
+    @return: The hunks of the word-diff between both texts, with markers for the skipped parts.
+    """
+    hunks = word_diff(old.replace('\r\n', '\n'), new.replace('\r\n', '\n'))
+    formatted_diffs = []
+    for index, hunk in enumerate(hunks):
+        if index < len(hunks) - 1:
+            hunk = hunk[:-1]  # the final line-break of a hunk is only kept for the last one
+        formatted_diffs.append('[...]\n\n' + hunk)
+    formatted_diffs.append('\n[...]')
+
+    return formatted_diffs
+
+
 class VersionRecorder:
     """
     Saves the states at different points in time as versions and provides utilities to detect changes
     in the current state against the previous.
+
+    The last persisted version is kept as a snapshot in a hidden sub-directory, against which changes
+    are detected without any help of external programs. Optionally, every version is additionally
+    exported as a commit into a git repository inside the directory.
     """
-    def __init__(self, dir_name: str):
+    def __init__(self, dir_name: str, export_to_git: bool = None, differ=None):
+        """
+        @param export_to_git: If every version should be committed into a git repository. If not
+         given, this is only done if the directory already is a git repository.
+        @param differ: Function which compares the old and the new content of a file and returns the
+         fragments describing the changes. If it returns none, the contents are regarded as equivalent
+         and the new one is taken over silently once the version is persisted. By default the files are compared word by word.
+        """
         self.is_creating_new_version = False
         self.dir = dir_name
+        self.differ = differ or word_diff_fragments
+        self.snapshot_dir = os.path.join(dir_name, '.snapshot')
+        self._file_ids_of_new_version = set()
+        self._written_file_ids = set()
+        self._changes_of_new_version = None  # = the cached result of changes_of_new_version
+        # the files which changes_of_new_version found to be equal / equivalent to the snapshot, they
+        #  are only taken over into the snapshot and its index once the version gets persisted
+        self._unchanged_file_ids = set()
+        self._equivalent_file_ids = set()
+
+        git_dir = os.path.join(dir_name, '.git')
+        self.export_to_git = export_to_git if export_to_git is not None else os.path.exists(git_dir)
 
         if not os.path.exists(dir_name):
             os.makedirs(dir_name)
-            os.chdir(dir_name)
-            try:
+
+        if not os.path.exists(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+            if os.path.exists(git_dir):
+                self._import_snapshot_from_git()
+
+        # {file id : [size, modification time]} of the files which are known to be equal to their
+        #  counterpart in the snapshot
+        self._index_path = os.path.join(self.snapshot_dir, '.index.json')
+        try:
+            with open(self._index_path, 'r') as f:
+                self._unchanged_file_stats = json.loads(f.read())
+        except (IOError, ValueError):
+            self._unchanged_file_stats = {}
+
+        if self.export_to_git:
+            if not os.path.exists(git_dir):
                 self._sub_run_git(['init'])
                 self._sub_run_git(['config', 'user.name', '"FileRecorder"'])
                 self._sub_run_git(['config', 'user.email', '"no-reply@localhost"'])
-            finally:
-                os.chdir('..')
+
+            gitignore_path = os.path.join(dir_name, '.gitignore')
+            if not os.path.exists(gitignore_path):
+                # the snapshot is only needed locally, the repository has the history already
+                with open(gitignore_path, 'w+') as f:
+                    f.write('/.snapshot/\n')
 
     def start_new_version(self):
         if (self.is_creating_new_version):
             raise ValueError('A new version is already being created!')
 
-        # We also want to detect if a page was deleted, so we delete all existing files
-        #  this way, when all currently present pages were saved, git notices that a file is missing
-        for file_name in os.listdir(self.dir):
-            file_path = os.path.join(self.dir, file_name)
-            if os.path.isfile(file_path):  # i.e. ignore sub-directories (including .git)
-                os.remove(file_path)
+        # We also want to detect if a page was deleted, so we remember which files are part of the
+        #  new version. All other files count as deleted, they are only removed from the directory
+        #  once the version gets persisted.
+        self._file_ids_of_new_version = set()
+        self._written_file_ids = set()
+        self._changes_of_new_version = None
 
         self.is_creating_new_version = True
 
+    def abort_new_version(self):
+        """
+        Drops the version which is currently being created, without persisting it.
+        The files of the aborted version stay in place until the next version is created.
+        """
+        self._changes_of_new_version = None
+        self._unchanged_file_ids = set()
+        self._equivalent_file_ids = set()
+        self.is_creating_new_version = False
+
     def save_file(self, file_id: str, content: str):
         if (not self.is_creating_new_version):
             raise ValueError(
                 'You need to start the creation of a new version to add files!'
             )
 
-        file_path = os.path.join(self.dir, file_id)
+        # Files are only written if their content really changed. This way unchanged files keep their
+        #  modification time, which lets the change detection skip them.
+        if not self.has_file(file_id) or self._read(self.dir, file_id) != content:
+            self._write(self.dir, file_id, content)
+            self._written_file_ids.add(file_id)
+
+        self._file_ids_of_new_version.add(file_id)
+        self._changes_of_new_version = None
+
+    def has_file(self, file_id: str) -> bool:
+        return os.path.isfile(os.path.join(self.dir, file_id))
+
+    def keep_file(self, file_id: str) -> bool:
+        """
+        Takes over the file with the given id unchanged into the new version.
+        @return: False if there is no such file, in which case it has to be saved normally.
+        """
+        if (not self.is_creating_new_version):
+            raise ValueError(
+                'You need to start the creation of a new version to keep files!'
+            )
+
+        if not self.has_file(file_id):
+            return False
 
-        with open(file_path, encoding='utf-8', errors='backslashreplace', mode='w+') as f:
-            f.write(content)
+        if file_id not in self._file_ids_of_new_version:
+            self._file_ids_of_new_version.add(file_id)
+            self._changes_of_new_version = None
+        return True
+
+    def _remove_files_not_in_new_version(self):
+        for file_id in self._list_files(self.dir):
+            if file_id not in self._file_ids_of_new_version:
+                os.remove(os.path.join(self.dir, file_id))
 
     def changes_of_new_version(self) -> CollectionOfChanges:
         if (not self.is_creating_new_version):
@@ -58,79 +161,124 @@ class VersionRecorder:
                 'You need to start the creation of a new version and add files to detect changes!'
             )
 
-        os.chdir(self.dir)
-        try:
-            entries_raw = self._sub_run_git(['status', '--short'])
-
-            if (entries_raw == ''):
-                return CollectionOfChanges(0, [], [], {})
-
-            entries_raw_without_final_linebreak = entries_raw[:-1]
-            entries = entries_raw_without_final_linebreak.split('\n')
-
-            added = []
-            deleted = {}
-            modified = {}
-
-            for entry in entries:
-                # An entry has the form of i.e. '?? asdf.txt' / ' M asdf.txt' / ' D asdf.txt'
-                #  (the 'AD' and 'AM' variants indicate that these files were added in a previous
-                #  run but not yet persisted as a new version)
-                indicator = entry[0:2]
-                file_name = entry[3:]
-
-                if (indicator == '??' or indicator == 'A '):
-                    added.append(file_name)
-                elif (indicator == ' D' or indicator == 'AD' or indicator == 'D '):
-                    old_raw = self._sub_run_git(
-                        ['--no-pager', 'diff', '--word-diff', '--', file_name]
-                    )
-                    old_without_diff_marks = old_raw.replace('[-', '').replace('-]', '')
-                    old = old_without_diff_marks.split('@@\n')
-                    old = old[1]  # because we don't need the preface
-                    deleted.update( {file_name : old} )
-                elif (indicator == ' M' or indicator == 'AM' or indicator == 'M '):
-                    diff_raw = self._sub_run_git(
-                        ['--no-pager', 'diff', '--word-diff', '--', file_name]
-                    )
-                    diffs = diff_raw.split('\n@@')
-                    diffs = diffs[1:]  # because we don't need the preface
-                    formatted_diffs = []
-                    for diff in diffs:
-                        diff = diff.replace('\r\n', '\n')
-                        diff_lines = diff.split('\n')
-                        diff_lines[0] = '[...]\n'
-                        formatted_diffs.append('\n'.join(diff_lines))
-                    formatted_diffs.append('\n[...]')
-                    modified.update( {file_name : formatted_diffs} )
-                else:
-                    raise RuntimeError(
-                        'Git diff reported an unexpected indicator (%s)!'%(indicator)
-                    )
-
-            changes_count = len(added) + len(deleted) + len(modified)
-        finally:
-            os.chdir('..')
-
-        return CollectionOfChanges(changes_count, added, deleted, modified)
+        if self._changes_of_new_version is not None:
+            # = nothing was saved since the changes were detected the last time
+            return self._changes_of_new_version
+
+        current_file_ids = set(self._list_files(self.dir)) & self._file_ids_of_new_version
+        persisted_file_ids = set(self._list_files(self.snapshot_dir))
+
+        added = sorted(current_file_ids - persisted_file_ids)
+
+        deleted = {}
+        for file_id in sorted(persisted_file_ids - current_file_ids):
+            deleted.update( {file_id : self._read(self.snapshot_dir, file_id)} )
+
+        modified = {}
+        self._unchanged_file_ids = set()
+        self._equivalent_file_ids = set()
+        for file_id in sorted(current_file_ids & persisted_file_ids):
+            if (    file_id not in self._written_file_ids
+                and self._unchanged_file_stats.get(file_id) == self._stat(file_id)
+            ):
+                continue  # = the file wasn't touched since it was known to be unchanged
 
+            old = self._read(self.snapshot_dir, file_id)
+            new = self._read(self.dir, file_id)
+            if old == new:
+                self._unchanged_file_ids.add(file_id)
+                continue
+
+            formatted_diffs = self.differ(old, new)
+            if len(formatted_diffs) == 0:
+                # = only the representation changed (i.e. the format of the files), which nobody has
+                #    to be notified about
+                self._equivalent_file_ids.add(file_id)
+                continue
+
+            modified.update( {file_id : formatted_diffs} )
+
+        changes_count = len(added) + len(deleted) + len(modified)
+
+        for file_id in list(self._unchanged_file_stats.keys()):
+            if file_id in deleted or file_id in modified or file_id not in current_file_ids:
+                del self._unchanged_file_stats[file_id]
+
+        self._changes_of_new_version = CollectionOfChanges(changes_count, added, deleted, modified)
+        return self._changes_of_new_version
 
     def persist_new_version(self):
-        if (self.changes_of_new_version().diff_count > 0):
-            os.chdir(self.dir)
-            try:
-                self._sub_run_git(['add', '.'])
+        """
+        Takes over the new version into the snapshot, also the files which only changed in their
+         representation (the new content silently replaces the old one), and remembers all files
+         which are now known to be unchanged.
+        """
+        changes = self.changes_of_new_version()
+        self._remove_files_not_in_new_version()
+        for file_id in self._equivalent_file_ids:
+            self._write(self.snapshot_dir, file_id, self._read(self.dir, file_id))
+        for file_id in self._unchanged_file_ids | self._equivalent_file_ids:
+            self._unchanged_file_stats[file_id] = self._stat(file_id)
+
+        if (changes.diff_count > 0):
+            for file_id in changes.added + list(changes.modified.keys()):
+                self._write(self.snapshot_dir, file_id, self._read(self.dir, file_id))
+                self._unchanged_file_stats[file_id] = self._stat(file_id)
+            for file_id in changes.deleted:
+                os.remove(os.path.join(self.snapshot_dir, file_id))
+        self._save_index()
+
+        if (changes.diff_count > 0):
+            if self.export_to_git:
+                self._sub_run_git(['add', '--all', '.'])
                 self._sub_run_git(['commit', '-m "new version!"'])
-            finally:
-                os.chdir('..')
 
+        self._changes_of_new_version = None
         self.is_creating_new_version = False
 
+    def _import_snapshot_from_git(self):
+        # = the directory was created by a version of this program which relied entirely on git, so
+        #    the last committed version becomes the snapshot
+        try:
+            file_ids_raw = self._sub_run_git(['ls-tree', '-r', '--name-only', 'HEAD'])
+        except RuntimeError:
+            return  # = there isn't any commit yet
+
+        for file_id in file_ids_raw.splitlines():
+            if file_id.startswith('.'):
+                continue
+            content = self._sub_run_git(['--no-pager', 'show', 'HEAD:%s'%(file_id)])
+            self._write(self.snapshot_dir, file_id, content)
+
     @staticmethod
-    def _sub_run_git(commands: []) -> str:
+    def _list_files(dir_name: str) -> [str]:
+        return [
+            file_name for file_name in os.listdir(dir_name)
+            if os.path.isfile(os.path.join(dir_name, file_name))  # i.e. ignore sub-directories
+                and not file_name.startswith('.')                 # and internal files
+        ]
+
+    def _stat(self, file_id: str) -> [int]:
+        stat = os.stat(os.path.join(self.dir, file_id))
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _save_index(self):
+        self._write(self.snapshot_dir, '.index.json', json.dumps(self._unchanged_file_stats))
+
+    @staticmethod
+    def _read(dir_name: str, file_id: str) -> str:
+        with open(os.path.join(dir_name, file_id), encoding='utf-8', errors='backslashreplace', newline='') as f:
+            return f.read()
+
+    @staticmethod
+    def _write(dir_name: str, file_id: str, content: str):
+        write_atomically(os.path.join(dir_name, file_id), content)
+
+    @metrics.timed('recorder.git')
+    def _sub_run_git(self, commands: []) -> str:
         commands.insert(0, 'git')
         result = subprocess.run(
-            commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            commands, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.dir,
             shell=(os.name == 'nt')  # True if the program runs on Windows, otherwise False
         )
 
@@ -0,0 +1,78 @@
+"""
+A pure-Python equivalent to `git diff --word-diff`.
+Changed words are marked with `[-deleted-]` and `{+added+}`, just like git does it.
+"""
+
+import difflib
+import re
+
+CONTEXT_LINES = 3
+# the same amount of unchanged lines around a change as git uses by default
+
+_token_pattern = re.compile(r'\s+|\S+')
+
+
+def word_diff(old: str, new: str, context_lines: int = CONTEXT_LINES) -> [str]:
+    """
+    Compares two texts line by line and the changed lines word by word.
+    @return: The hunks of the diff, each as the marked-up text of the affected lines, in the same
+     format as git prints them beneath the hunk-header.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+
+    hunks = []
+    line_matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for group in line_matcher.get_grouped_opcodes(context_lines):
+        hunk = ''
+        for tag, old_start, old_end, new_start, new_end in group:
+            if tag == 'equal':
+                hunk += ''.join(new_lines[new_start:new_end])
+            else:
+                hunk += _diff_words(
+                    ''.join(old_lines[old_start:old_end]), ''.join(new_lines[new_start:new_end])
+                )
+
+        if not hunk.endswith('\n'):
+            hunk += '\n'
+        hunks.append(hunk)
+
+    return hunks
+
+
+def _diff_words(old: str, new: str) -> str:
+    old_tokens = _token_pattern.findall(old)
+    new_tokens = _token_pattern.findall(new)
+
+    result = ''
+    token_matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in token_matcher.get_opcodes():
+        old_part = ''.join(old_tokens[old_start:old_end])
+        new_part = ''.join(new_tokens[new_start:new_end])
+
+        if tag == 'equal' or (old_part.isspace() and new_part.isspace()):
+            # like git, we don't care about changes in whitespace
+            result += new_part
+            continue
+
+        if tag in ('delete', 'replace'):
+            result += _mark(old_part, '[-', '-]')
+        if tag in ('insert', 'replace'):
+            result += _mark(new_part, '{+', '+}')
+
+    return result
+
+
+def _mark(text: str, start_marker: str, end_marker: str) -> str:
+    # git never lets a marked segment span multiple lines, so neither do we
+    marked_lines = []
+    for line in text.split('\n'):
+        content = line.strip()
+        if content == '':
+            marked_lines.append(line)
+        else:
+            leading_whitespace = line[:len(line) - len(line.lstrip())]
+            trailing_whitespace = line[len(line.rstrip()):]
+            marked_lines.append(leading_whitespace + start_marker + content + end_marker + trailing_whitespace)
+
+    return '\n'.join(marked_lines)